@@ -0,0 +1,89 @@
+# benchmarks/bench_diff.py
+#
+# Compares the shared diff engine (src/diff_engine.py) with the previous
+# difflib.SequenceMatcher path on synthetic rulebooks of 10k-100k lines.
+# Reports wall time and how many lines each approach kept as unchanged
+# (higher is better: fewer spurious deletions/insertions in the redline).
+#
+#   python benchmarks/bench_diff.py --sizes 10000 50000 100000 --edits 200
+
+import argparse
+import difflib
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.diff_engine import diff_opcodes
+
+BOILERPLATE = [
+    "(Amended by SR-FINRA-2011-001 eff. Jan. 1, 2012.)",
+    "Reserved.",
+    "• • • Supplementary Material: --------------",
+    "Selected Notice: 11-25, 12-25.",
+]
+
+
+def synthetic_rulebook(size, rng):
+    """Legal-looking text where a fair share of lines are repeated boilerplate."""
+    lines = []
+    for i in range(size):
+        if rng.random() < 0.25:
+            lines.append(rng.choice(BOILERPLATE))
+        else:
+            lines.append(f"({i % 26}) A member shall, with respect to account {rng.randrange(size)}, "
+                         f"maintain records of obligation {i}.")
+    return lines
+
+
+def amend(lines, edits, rng):
+    new = list(lines)
+    for n in range(edits):
+        idx = rng.randrange(len(new))
+        action = rng.random()
+        if action < 0.4:
+            new[idx] = new[idx] + " As amended."
+        elif action < 0.7:
+            new.insert(idx, rng.choice(BOILERPLATE) if rng.random() < 0.5 else f"New provision {n}.")
+        else:
+            del new[idx]
+    return new
+
+
+def kept(opcodes):
+    return sum(i2 - i1 for tag, i1, i2, _, _ in opcodes if tag == 'equal')
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Diff engine benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000, 100000])
+    parser.add_argument("--edits", type=int, default=200)
+    parser.add_argument("--difflib-max", type=int, default=100000,
+                        help="Skip difflib for rulebooks larger than this")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    print(f"{'lines':>8} {'engine':>10} {'kept':>9} {'difflib':>10} {'kept':>9} {'no-autojunk':>12} {'kept':>9}")
+    for size in args.sizes:
+        old = synthetic_rulebook(size, rng)
+        new = amend(old, args.edits, rng)
+
+        engine_s, engine_ops = timed(lambda: diff_opcodes(old, new))
+        row = f"{size:>8} {engine_s:>9.2f}s {kept(engine_ops):>9}"
+        if size <= args.difflib_max:
+            dl_s, dl_ops = timed(lambda: difflib.SequenceMatcher(None, old, new).get_opcodes())
+            nj_s, nj_ops = timed(lambda: difflib.SequenceMatcher(None, old, new, autojunk=False).get_opcodes())
+            row += f" {dl_s:>9.2f}s {kept(dl_ops):>9} {nj_s:>11.2f}s {kept(nj_ops):>9}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
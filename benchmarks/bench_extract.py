@@ -0,0 +1,85 @@
+# benchmarks/bench_extract.py
+#
+# Parse time per page for rule text extraction: the previous approach
+# (full html.parser parse, several soup.find passes, get_text twice per
+# paragraph) versus src.downloader.extract_rule_text (container-only parse,
+# lxml when installed, single get_text pass).
+#
+#   python benchmarks/bench_extract.py --pages "saved_pages/*.html" --repeat 20
+#
+# Without --pages (or if nothing matches) synthetic FINRA-style pages are used.
+
+import argparse
+import glob
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup
+from src.downloader import HTML_PARSER, extract_rule_text
+
+
+def old_extract(content):
+    soup = BeautifulSoup(content, 'html.parser')
+    text = ""
+    target = soup.find('div', class_='rule-book-content') or \
+             soup.find('div', class_='field-item even') or \
+             soup.find('div', id='block-system-main')
+    if target:
+        text = target.get_text(separator='\n').strip()
+    if len(text) < 100:
+        paragraphs = soup.find_all('p')
+        text = "\n\n".join([p.get_text().strip() for p in paragraphs if len(p.get_text().strip()) > 20])
+    return text
+
+
+def synthetic_page(paragraphs, with_container=True):
+    """A FINRA-like page: heavy navigation and footer chrome around the rule body."""
+    nav = "".join(f'<li class="menu-item"><a href="/topic/{i}">Topic {i}</a><ul>'
+                  + "".join(f'<li><a href="/topic/{i}/{j}">Sub {j}</a></li>' for j in range(8))
+                  + '</ul></li>' for i in range(60))
+    body = "".join(f'<p>({chr(97 + i % 26)}) A member shall, in connection with obligation {i}, '
+                   f'maintain and preserve records as prescribed by SEA Rule 17a-4.</p>' for i in range(paragraphs))
+    rule = f'<div class="rule-book-content">{body}</div>' if with_container else f'<div class="content">{body}</div>'
+    footer = "".join(f'<div class="footer-col"><p>Footer link block {i} with some descriptive text.</p></div>'
+                     for i in range(40))
+    return (f'<html><head><title>Rule</title><script>var x = {{}};</script></head><body>'
+            f'<header><nav><ul>{nav}</ul></nav></header><main>{rule}</main><footer>{footer}</footer></body></html>'
+            ).encode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rule text extraction benchmark")
+    parser.add_argument("--pages", default=os.path.join(os.path.dirname(__file__), "sample_pages", "*.html"),
+                        help="Glob of saved HTML pages")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    pages = [(os.path.basename(path), open(path, 'rb').read()) for path in sorted(glob.glob(args.pages))]
+    if not pages:
+        print("No saved pages found; using synthetic FINRA-style pages.")
+        pages = [('synthetic-small', synthetic_page(40)), ('synthetic-large', synthetic_page(600)),
+                 ('synthetic-no-container', synthetic_page(200, with_container=False))]
+
+    print(f"Targeted extraction parser: {HTML_PARSER}")
+    print(f"{'page':<28} {'size':>8} {'old':>10} {'new':>10} {'speedup':>8} {'same text':>10}")
+    for name, content in pages:
+        old_times, new_times = [], []
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            old_text = old_extract(content)
+            t1 = time.perf_counter()
+            new_text = extract_rule_text(content)
+            t2 = time.perf_counter()
+            old_times.append((t1 - t0) * 1000)
+            new_times.append((t2 - t1) * 1000)
+        old_ms, new_ms = statistics.median(old_times), statistics.median(new_times)
+        print(f"{name[:28]:<28} {len(content) // 1024:>5} KB {old_ms:>8.1f}ms {new_ms:>8.1f}ms "
+              f"{old_ms / new_ms if new_ms else 0:>7.1f}x {str(old_text == new_text):>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+# benchmarks/bench_pipeline.py
+#
+# End-to-end benchmark of main.run_tracker without network access.
+# Starts a local HTTP server that serves synthetic FINRA-style rule pages
+# (configurable size and change rate), writes a tracked_rules.json that
+# points at it, and runs the full pipeline for several rounds in a
+# temporary working directory. Per-stage call counts, throughput and
+# latency percentiles (from the tracker's own spans, src/metrics.py) are
+# written as JSON. With --replay every round is also recorded to an HTTP
+# archive, then backfilled from it into a fresh database; the replay time and
+# whether both databases hold identical versions are reported as well.
+#
+#   python benchmarks/bench_pipeline.py --rules 200 --paragraphs 300 \
+#       --change-rate 0.1 --rounds 3 --workers 8 --output bench.json
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+class RulePages:
+    """Synthetic rule pages; amend() changes a random subset between rounds."""
+
+    def __init__(self, rules, paragraphs, seed=11):
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.bodies = {}
+        for r in range(rules):
+            self.bodies[f"/rules/{r}"] = [
+                f"({chr(97 + p % 26)}) A member shall, in connection with obligation {p} of rule {r}, "
+                f"maintain records for {self.rng.randint(1, 10)} years."
+                for p in range(paragraphs)
+            ]
+        self.pages = {}
+        for path in self.bodies:
+            self._render(path)
+
+    def _render(self, path):
+        body = "".join(f"<p>{p}</p>" for p in self.bodies[path])
+        html = (f'<html><body><nav><a href="/">Home</a></nav>'
+                f'<div class="rule-book-content">{body}</div><footer>FINRA</footer></body></html>').encode('utf-8')
+        self.pages[path] = (html, '"%s"' % hashlib.md5(html).hexdigest())
+
+    def amend(self, change_rate, round_no):
+        changed = 0
+        with self.lock:
+            for path, paragraphs in self.bodies.items():
+                if self.rng.random() < change_rate:
+                    for _ in range(self.rng.randint(1, 3)):
+                        idx = self.rng.randrange(len(paragraphs))
+                        paragraphs[idx] += f" Amended in round {round_no} effective January 1, 2027 by the SEC."
+                    self._render(path)
+                    changed += 1
+        return changed
+
+    def get(self, path):
+        with self.lock:
+            return self.pages.get(path)
+
+
+def make_handler(pages, latency=0.0):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            if latency:
+                time.sleep(latency)  # simulated network / server time
+            page = pages.get(self.path)
+            if page is None:
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            html, etag = page
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(html)))
+            self.end_headers()
+            self.wfile.write(html)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silences the tracker's output, including that of --pipeline worker processes."""
+    sys.stdout.flush()
+    saved = os.dup(1)
+    with open(os.devnull, "w") as devnull:
+        os.dup2(devnull.fileno(), 1)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                yield
+        finally:
+            sys.stdout.flush()
+            os.dup2(saved, 1)
+            os.close(saved)
+
+
+def version_texts(database_manager, rules):
+    return {f"BENCH-{r}": [database_manager.get_version_text(item['id'])
+                           for item in reversed(database_manager.get_version_history(f"BENCH-{r}"))]
+            for r in range(rules)}
+
+
+def backfill_from_archive(tracker, database_manager, http_archive, args):
+    """Backfills a fresh database from the recorded rounds and compares it with the live one."""
+    live = version_texts(database_manager, args.rules)
+    live_path = database_manager.DB_PATH
+    database_manager.DB_PATH = "data/replayed.db"
+    try:
+        http_archive.configure_archive("archive", 'replay')
+        start = time.perf_counter()
+        with quiet():
+            tracker.run_backfill(workers=args.workers, pipeline=args.pipeline)
+        seconds = time.perf_counter() - start
+        replayed = version_texts(database_manager, args.rules)
+    finally:
+        http_archive.configure_archive()
+        database_manager.DB_PATH = live_path
+    return {'sessions': len(http_archive.sessions("archive")), 'seconds': round(seconds, 3),
+            'identical_versions': replayed == live}
+
+
+def stage_table(spans):
+    """metrics.summarize() output in milliseconds, plus throughput per stage."""
+    from src import metrics
+    table = {}
+    for stage, stats in metrics.summarize(spans).items():
+        table[stage] = {
+            'calls': stats['count'],
+            'total_s': round(stats['total_s'], 4),
+            'throughput_per_s': round(stats['count'] / stats['total_s'], 1) if stats['total_s'] else None,
+            'p50_ms': round(stats['p50_s'] * 1000, 3),
+            'p90_ms': round(stats['p90_s'] * 1000, 3),
+            'p99_ms': round(stats['p99_s'] * 1000, 3),
+            'max_ms': round(stats['max_s'] * 1000, 3),
+        }
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end tracker benchmark against a local stub server")
+    parser.add_argument("--rules", type=int, default=100)
+    parser.add_argument("--paragraphs", type=int, default=200, help="Paragraphs per rule page")
+    parser.add_argument("--change-rate", type=float, default=0.1, help="Fraction of rules amended per round")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Simulated response time of the stub server")
+    parser.add_argument("--rounds", type=int, default=3, help="Runs after the initial baseline run")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--pipeline", action="store_true", help="Use the staged pipeline mode of run_tracker")
+    parser.add_argument("--replay", action="store_true",
+                        help="Record the rounds, then time an offline backfill from the recording")
+    parser.add_argument("--no-nlp", action="store_true",
+                        help="Skip spaCy (e.g. when the model is not installed); sequential mode only")
+    parser.add_argument("--output", default=None, help="Write JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    pages = RulePages(args.rules, args.paragraphs)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(pages, args.latency_ms / 1000))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    original_cwd = os.getcwd()
+    spans = []
+    counters = {}
+    runs = []
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            os.makedirs("data")
+            with open("data/tracked_rules.json", "w") as f:
+                json.dump([{"id": f"BENCH-{r}", "name": f"Synthetic Rule {r}", "url": f"{base_url}/rules/{r}"}
+                           for r in range(args.rules)], f)
+
+            import main as tracker
+            from src.downloader import configure_politeness
+            from src import database_manager, metrics, http_archive
+            if args.no_nlp:
+                tracker.analyze_changes_batch = lambda changes, **kwargs: {}
+            configure_politeness(requests_per_second=0, max_in_flight=args.workers)
+
+            for round_no in range(args.rounds + 1):
+                amended = pages.amend(args.change_rate, round_no) if round_no else 0
+                if args.replay:
+                    http_archive.configure_archive("archive", 'record')  # one session per round
+                start = time.perf_counter()
+                with quiet():
+                    results = tracker.run_tracker(workers=args.workers, pipeline=args.pipeline)
+                seconds = time.perf_counter() - start
+                # run_tracker resets the metrics at the start of every run
+                data = metrics.snapshot()
+                spans.extend(data['spans'])
+                for name, value in data['counters'].items():
+                    counters[name] = counters.get(name, 0) + value
+                statuses = {}
+                for _, status, _ in results:
+                    statuses[status] = statuses.get(status, 0) + 1
+                runs.append({'round': round_no, 'amended': amended, 'seconds': round(seconds, 3),
+                             'rules_per_s': round(len(results) / seconds, 1), 'statuses': statuses})
+            if args.replay:
+                replay = backfill_from_archive(tracker, database_manager, http_archive, args)
+            database_manager.close_connections()
+        finally:
+            os.chdir(original_cwd)
+            server.shutdown()
+
+    output = {
+        'config': vars(args),
+        'runs': runs,
+        'counters': counters,
+        'stages': stage_table(spans),
+    }
+    if args.replay:
+        output['replay'] = replay
+    text = json.dumps(output, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+        print(f"Results written to {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
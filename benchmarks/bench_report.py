@@ -0,0 +1,108 @@
+# benchmarks/bench_report.py
+#
+# Time and peak RSS of HTML redline report generation on very large
+# synthetic rules: the previous difflib.HtmlDiff.make_file path versus the
+# streaming writer in src/reporter.py (side-by-side and compact modes).
+# Each measurement runs in a fresh interpreter so peak RSS isn't shared.
+#
+#   python benchmarks/bench_report.py --sizes 5000 20000 100000 --old-max 20000
+
+import argparse
+import difflib
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def synthetic_rule(size, edits, seed=7):
+    rng = random.Random(seed)
+    old = [f"({i % 26}) A member shall maintain records of obligation {i} for account {rng.randrange(size)}."
+           for i in range(size)]
+    new = list(old)
+    for n in range(edits):
+        idx = rng.randrange(len(new))
+        if rng.random() < 0.6:
+            new[idx] = new[idx].replace("shall", "must") + " As amended."
+        else:
+            new.insert(idx, f"New provision {n} on supervisory review.")
+    return "\n".join(old), "\n".join(new)
+
+
+def old_htmldiff_report(rule_id, old_text, new_text, output_dir):
+    """The pre-streaming implementation: whole report built in memory, then copied by replace()."""
+    html_content = difflib.HtmlDiff().make_file(
+        old_text.splitlines(), new_text.splitlines(),
+        fromdesc=f"Baseline Version ({rule_id})", todesc="New Version", context=True, numlines=5
+    )
+    html_content = html_content.replace('<head>', '<head><style></style>')
+    filename = os.path.join(output_dir, f"{rule_id}_CHANGE_REPORT.html")
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write(html_content)
+    return filename
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return peak / 1024 / (1024 if sys.platform == 'darwin' else 1)
+
+
+def worker(mode, size, edits):
+    from src.reporter import generate_html_report
+
+    old_text, new_text = synthetic_rule(size, edits)
+    baseline = peak_rss_mb()
+    with tempfile.TemporaryDirectory() as output_dir:
+        start = time.perf_counter()
+        if mode == 'htmldiff':
+            path = old_htmldiff_report("BENCH", old_text, new_text, output_dir)
+        else:
+            path = generate_html_report("BENCH", "Benchmark", old_text, new_text,
+                                        compact=(mode == 'compact'), output_dir=output_dir)
+        seconds = time.perf_counter() - start
+        size_kb = os.path.getsize(path) / 1024
+    print(json.dumps({'seconds': seconds, 'rss_mb': peak_rss_mb(), 'extra_rss_mb': peak_rss_mb() - baseline,
+                      'size_kb': size_kb}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report generation benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5000, 20000, 100000])
+    parser.add_argument("--edits", type=int, default=300)
+    parser.add_argument("--old-max", type=int, default=20000,
+                        help="Skip the HtmlDiff path above this many lines (it is very slow)")
+    parser.add_argument("--worker", nargs=3, metavar=("MODE", "SIZE", "EDITS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        mode, size, edits = args.worker
+        worker(mode, int(size), int(edits))
+        return
+
+    print(f"{'lines':>8} {'mode':<10} {'time':>9} {'peak RSS':>10} {'+RSS':>9} {'report':>10}")
+    for size in args.sizes:
+        for mode in ('htmldiff', 'stream', 'compact'):
+            if mode == 'htmldiff' and size > args.old_max:
+                continue
+            result = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--worker", mode, str(size), str(args.edits)],
+                capture_output=True, text=True, cwd=ROOT
+            )
+            if result.returncode != 0:
+                print(f"{size:>8} {mode:<10} failed: {result.stderr.strip().splitlines()[-1]}")
+                continue
+            r = json.loads(result.stdout.strip().splitlines()[-1])
+            print(f"{size:>8} {mode:<10} {r['seconds']:>8.2f}s {r['rss_mb']:>7.1f} MB {r['extra_rss_mb']:>6.1f} MB "
+                  f"{r['size_kb']:>7.0f} KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# benchmarks/bench_startup.py
+#
+# Measures cold import time of the tracker's entry points in fresh
+# interpreters (python -X importtime) and checks that heavy dependencies,
+# spaCy in particular, are not pulled in at import time.
+#
+#   python benchmarks/bench_startup.py --runs 5 --max-ms 1500
+#
+# Exits non-zero if a module is slower than --max-ms or imports a forbidden
+# module, so it can be used as a regression check.
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Module -> packages that must NOT be loaded just by importing it
+TARGETS = {
+    'main': ['spacy'],
+    'src.analyzer': ['spacy'],
+    'src.database_manager': ['spacy', 'bs4', 'requests'],
+}
+
+
+def measure(module):
+    """Returns (total import microseconds, set of all imported top-level packages)."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+
+    total_us = 0
+    packages = set()
+    for line in result.stderr.splitlines():
+        # "import time:  self [us] | cumulative | imported package"
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        stripped = name.strip()
+        packages.add(stripped.split('.')[0])
+        if stripped == module:
+            total_us = int(cumulative)
+    return total_us, packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-ms", type=float, default=None,
+                        help="Fail if any module's median import time exceeds this")
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'module':<24} {'median':>10} {'min':>10}  forbidden imports")
+    for module, forbidden in TARGETS.items():
+        try:
+            runs = [measure(module) for _ in range(args.runs)]
+        except RuntimeError as e:
+            print(f"{module:<24} {'skipped':>10}  ({e})")
+            continue
+        times = [us / 1000 for us, _ in runs]
+        leaked = sorted(set(forbidden) & runs[0][1])
+        median = statistics.median(times)
+        print(f"{module:<24} {median:>8.1f}ms {min(times):>8.1f}ms  {', '.join(leaked) or '-'}")
+        if leaked or (args.max_ms is not None and median > args.max_ms):
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# benchmarks/bench_storage.py
+#
+# Compares database size and read latency of plain-text version storage
+# (the original schema), delta storage with periodic keyframes and the
+# content-addressed blob store. --reverts makes that share of versions
+# restore an earlier text, which only the blob store deduplicates.
+#
+#   python benchmarks/bench_storage.py --rules 50 --versions 40 --lines 400
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import database_manager as db
+
+
+def synthetic_history(versions, lines, seed, reverts=0.0):
+    """Yields successive versions of a rule, each amending a few paragraphs or reverting to an earlier version."""
+    rng = random.Random(seed)
+    paragraphs = [f"({i}) A member shall observe provision {i} of this Rule with respect to customer accounts {rng.random():.6f}."
+                  for i in range(lines)]
+    past = []
+    for v in range(versions):
+        if past and rng.random() < reverts:
+            paragraphs = list(rng.choice(past))
+            yield "\n".join(paragraphs)
+            continue
+        for _ in range(rng.randint(1, 4)):
+            idx = rng.randrange(len(paragraphs))
+            action = rng.random()
+            if action < 0.6:
+                paragraphs[idx] = paragraphs[idx] + f" As amended in version {v}."
+            elif action < 0.8:
+                paragraphs.insert(idx, f"New paragraph added in version {v} concerning supervisory review.")
+            elif len(paragraphs) > 10:
+                del paragraphs[idx]
+        past.append(list(paragraphs))
+        yield "\n".join(paragraphs)
+
+
+def run(mode, args, workdir):
+    db.DB_PATH = os.path.join(workdir, f"bench_{mode}.db")
+    db.STORAGE_MODE = mode
+    db.KEYFRAME_INTERVAL = args.keyframe
+    db.setup_database()
+
+    start = time.perf_counter()
+    for r in range(args.rules):
+        for text in synthetic_history(args.versions, args.lines, seed=r, reverts=args.reverts):
+            db.log_new_version(f"RULE-{r}", text, summary="bench")
+    write_seconds = time.perf_counter() - start
+
+    conn = db.create_connection()
+    ids = [row[0] for row in conn.execute("SELECT id FROM rule_versions")]
+    conn.execute("VACUUM;")
+    # WAL mode: fold the log back into the main file before measuring it
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+
+    rng = random.Random(0)
+    latest, random_reads = [], []
+    for r in range(args.rules):
+        t0 = time.perf_counter()
+        db.get_latest_version(f"RULE-{r}")
+        latest.append((time.perf_counter() - t0) * 1000)
+    for version_id in rng.sample(ids, min(args.reads, len(ids))):
+        t0 = time.perf_counter()
+        db.get_version_text(version_id)
+        random_reads.append((time.perf_counter() - t0) * 1000)
+
+    return {
+        'mode': mode,
+        'size_kb': os.path.getsize(db.DB_PATH) / 1024,
+        'write_s': write_seconds,
+        'latest_ms': statistics.median(latest),
+        'random_ms': statistics.median(random_reads),
+        'random_p95_ms': sorted(random_reads)[int(len(random_reads) * 0.95) - 1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Version storage benchmark")
+    parser.add_argument("--rules", type=int, default=20)
+    parser.add_argument("--versions", type=int, default=30)
+    parser.add_argument("--lines", type=int, default=300)
+    parser.add_argument("--keyframe", type=int, default=db.KEYFRAME_INTERVAL)
+    parser.add_argument("--reads", type=int, default=200)
+    parser.add_argument("--reverts", type=float, default=0.0,
+                        help="Share of versions that restore an earlier text (default: 0)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results = [run(mode, args, workdir) for mode in ('text', 'delta', 'blob')]
+        db.close_connections()
+
+    print(f"{args.rules} rules x {args.versions} versions x ~{args.lines} lines, keyframe every {args.keyframe}, "
+          f"{args.reverts:.0%} reverts")
+    print(f"{'mode':<6} {'db size':>12} {'write':>9} {'latest p50':>11} {'random p50':>11} {'random p95':>11}")
+    for r in results:
+        print(f"{r['mode']:<6} {r['size_kb']:>9.0f} KB {r['write_s']:>8.2f}s {r['latest_ms']:>9.2f}ms "
+              f"{r['random_ms']:>9.2f}ms {r['random_p95_ms']:>9.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,15 @@
 # dashboard.py
 
 import streamlit as st
-import sqlite3
 import pandas as pd
 import json
-import difflib
-import spacy
-import os
+import datetime
+import html
 import streamlit.components.v1 as components
 from src.downloader import download_rule
-from src.database_manager import get_latest_version, log_new_version
-
-# --- Load NLP Model ---
-try:
-    nlp = spacy.load("en_core_web_sm")
-except OSError:
-    pass 
+from src.diff_engine import diff_opcodes, iter_side_by_side
+from src.sections import compare_sections, diff_stats, section_label, summarize_sections
+from src.database_manager import get_latest_version, get_latest_version_id, get_version_history, get_version_text, log_new_version, delete_rule_history, search_versions, get_version_diff, store_version_diff, get_blame, get_daily_summary, get_portfolio_summary, count_tracked_rules, iter_tracked_rules
 
 # --- Configuration ---
 st.set_page_config(page_title="Regulatory Harmony", layout="wide", page_icon="🌑")
@@ -95,69 +89,164 @@ st.markdown("""
 
 # --- Helper Functions ---
 def get_rules():
+    # Discovered rules (python main.py --discover) take over from the JSON file once there are any
+    if count_tracked_rules(): return list(iter_tracked_rules())
     try:
         with open('data/tracked_rules.json', 'r') as f: return json.load(f)
     except FileNotFoundError: return []
 
+# Cache layer: history is keyed on the rule's newest version id, so it is
+# recomputed only when a new version lands. Stored versions never change,
+# so their text can be cached by id alone.
+@st.cache_data(max_entries=64, show_spinner=False)
+def _cached_history(rule_id, latest_version_id):
+    history = get_version_history(rule_id)
+    columns = ['id', 'check_date', 'text_length', 'line_count', 'word_count', 'change_summary', 'blob_hash']
+    return pd.DataFrame(history, columns=columns) if history else pd.DataFrame()
+
 def get_history(rule_id):
-    if not os.path.exists('data/regulations.db'): return pd.DataFrame()
-    conn = sqlite3.connect('data/regulations.db')
-    try:
-        df = pd.read_sql_query("SELECT id, check_date, length(rule_text) as text_length, change_summary FROM rule_versions WHERE rule_id = ? ORDER BY check_date DESC", conn, params=(rule_id,))
-    except Exception: df = pd.DataFrame()
-    finally: conn.close()
-    return df
+    return _cached_history(rule_id, get_latest_version_id(rule_id))
 
+@st.cache_data(max_entries=256, show_spinner=False)
 def get_specific_version_text(version_id):
-    conn = sqlite3.connect('data/regulations.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT rule_text FROM rule_versions WHERE id = ?", (version_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else ""
+    # Versions may be stored as compressed deltas; the database layer rebuilds them
+    return get_version_text(int(version_id))
 
 # --- CUSTOM DIFF ENGINE ---
-def render_diff_html(old_text, new_text):
-    a = old_text.splitlines()
-    b = new_text.splitlines()
-    matcher = difflib.SequenceMatcher(None, a, b)
-    html = []
-    html.append("""
+def render_segments(segments, word_cls):
+    if segments is None: return ""
+    return "".join(f'<span class="{word_cls}">{html.escape(t)}</span>' if changed and word_cls else html.escape(t) for changed, t in segments)
+
+# Redline view limits: context kept around each change, rows per page, and the
+# largest unchanged stretch that is still shipped (collapsed) to the browser
+REDLINE_CONTEXT = 3
+REDLINE_ROWS_PER_PAGE = 400
+MAX_EXPANDABLE_LINES = 200
+
+DIFF_CSS = """
     <style>
         .diff-row { display: flex; border-bottom: 1px solid #333; font-family: 'Helvetica Neue', sans-serif; font-size: 13px; }
         .diff-cell { flex: 1; padding: 5px 10px; word-wrap: break-word; white-space: pre-wrap; color: #ffffff; }
         .diff-num { width: 30px; color: #666; text-align: right; padding-right: 10px; border-right: 1px solid #333; user-select: none; }
         .added { background-color: rgba(15, 61, 27, 0.6); color: #84e897; } 
         .deleted { background-color: rgba(61, 20, 20, 0.6); color: #f28b8b; }
+        .word-add { background-color: rgba(132, 232, 151, 0.35); border-radius: 3px; }
+        .word-del { background-color: rgba(242, 139, 139, 0.35); border-radius: 3px; text-decoration: line-through; }
         .empty { background-color: transparent; }
+        .diff-fold { border-bottom: 1px solid #333; font-family: 'Helvetica Neue', sans-serif; font-size: 12px; color: #888; }
+        .diff-fold summary, div.diff-fold { padding: 4px 10px; cursor: pointer; background: rgba(255,255,255,0.03); }
+        .diff-section { padding: 6px 10px; border-bottom: 1px solid #333; font-family: 'Helvetica Neue', sans-serif; font-size: 12px; font-weight: bold; color: #ddd; background: rgba(255,255,255,0.08); }
     </style>
-    <div style="background: rgba(0,0,0,0.2); border-radius: 8px; border: 1px solid #444; overflow: hidden;">
-    """)
-    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
-        if tag == 'equal':
-            for i, line in enumerate(a[i1:i2]):
-                html.append(f'<div class="diff-row"><div class="diff-num">{i1+i+1}</div><div class="diff-cell">{line}</div><div class="diff-num">{j1+i+1}</div><div class="diff-cell">{line}</div></div>')
-        elif tag == 'replace':
-            old_chunk = a[i1:i2]
-            new_chunk = b[j1:j2]
-            max_len = max(len(old_chunk), len(new_chunk))
-            old_chunk += [''] * (max_len - len(old_chunk))
-            new_chunk += [''] * (max_len - len(new_chunk))
-            for i in range(max_len):
-                o_text, n_text = old_chunk[i], new_chunk[i]
-                o_cls, n_cls = ("deleted" if o_text else "empty"), ("added" if n_text else "empty")
-                html.append(f'<div class="diff-row"><div class="diff-num">{i1+i+1 if o_text else ""}</div><div class="diff-cell {o_cls}">{o_text}</div><div class="diff-num">{j1+i+1 if n_text else ""}</div><div class="diff-cell {n_cls}">{n_text}</div></div>')
-        elif tag == 'delete':
-            for i, line in enumerate(a[i1:i2]):
-                html.append(f'<div class="diff-row"><div class="diff-num">{i1+i+1}</div><div class="diff-cell deleted">{line}</div><div class="diff-num"></div><div class="diff-cell empty"></div></div>')
-        elif tag == 'insert':
-            for i, line in enumerate(b[j1:j2]):
-                html.append(f'<div class="diff-row"><div class="diff-num"></div><div class="diff-cell empty"></div><div class="diff-num">{j1+i+1}</div><div class="diff-cell added">{line}</div></div>')
-    html.append("</div>")
-    return "".join(html)
+"""
+
+def render_row(tag, old_no, old_seg, new_no, new_seg):
+    if tag == 'equal':
+        o_cls = n_cls = ""
+    else:
+        o_cls, n_cls = ("deleted" if old_seg else "empty"), ("added" if new_seg else "empty")
+    o_html = render_segments(old_seg, "word-del" if tag == 'replace' else "")
+    n_html = render_segments(new_seg, "word-add" if tag == 'replace' else "")
+    return f'<div class="diff-row"><div class="diff-num">{old_no or ""}</div><div class="diff-cell {o_cls}">{o_html}</div><div class="diff-num">{new_no or ""}</div><div class="diff-cell {n_cls}">{n_html}</div></div>'
+
+def render_fold(a, b, i1, i2, j1, j2):
+    """An unchanged stretch collapsed into one expandable line."""
+    label = f"⋯ {i2 - i1} unchanged lines ({i1 + 1}–{i2})"
+    if i2 - i1 > MAX_EXPANDABLE_LINES:
+        return f'<div class="diff-fold">{label}</div>'
+    rows = "".join(render_row(*row) for row in iter_side_by_side(a, b, [('equal', i1, i2, j1, j2)]))
+    return f'<details class="diff-fold"><summary>{label}</summary>{rows}</details>'
+
+def render_section_header(change):
+    if change['status'] == 'formatting':
+        return '<div class="diff-section">Whole text — formatting only (whitespace or line wrapping)</div>'
+    if change['status'] == 'renumbered':
+        label = f"{section_label(change['old_path'])} → {section_label(change['path'])}"
+    else:
+        label = section_label(change['path'])
+    return f'<div class="diff-section">{html.escape(label)} — {change["status"]}</div>'
+
+def render_diff_pages(old_text, new_text, section_changes):
+    """
+    Renders the redline of a stored version diff as a list of HTML pages, one
+    heading per changed subsection. Unchanged stretches longer than
+    2 * REDLINE_CONTEXT lines collapse into expandable blocks, and each page holds
+    at most REDLINE_ROWS_PER_PAGE visible rows. Returns [] if nothing changed.
+
+    Texts that differ although no subsection did (only whitespace or line
+    wrapping changed) are shown as one whole-text block instead.
+    """
+    if not section_changes and old_text == new_text:
+        return []
+    a = old_text.splitlines()
+    b = new_text.splitlines()
+    if not section_changes:
+        section_changes = [{'status': 'formatting', 'path': '', 'opcodes': diff_opcodes(a, b)}]
+
+    # Visible items in order: one heading, rendered row or fold each
+    items = []
+    for change in section_changes:
+        items.append(render_section_header(change))
+        opcodes = change['opcodes']
+        last = len(opcodes) - 1
+        for n, (tag, i1, i2, j1, j2) in enumerate(opcodes):
+            keep_head = REDLINE_CONTEXT if n > 0 else 0
+            keep_tail = REDLINE_CONTEXT if n < last else 0
+            if tag == 'equal' and i2 - i1 > keep_head + keep_tail:
+                head = [('equal', i1, i1 + keep_head, j1, j1 + keep_head)]
+                tail = [('equal', i2 - keep_tail, i2, j2 - keep_tail, j2)]
+                items.extend(render_row(*row) for row in iter_side_by_side(a, b, head))
+                items.append(render_fold(a, b, i1 + keep_head, i2 - keep_tail, j1 + keep_head, j2 - keep_tail))
+                items.extend(render_row(*row) for row in iter_side_by_side(a, b, tail))
+            else:
+                # Replaced lines are paired and word-diffed
+                items.extend(render_row(*row) for row in iter_side_by_side(a, b, [(tag, i1, i2, j1, j2)]))
+
+    pages = []
+    for start in range(0, len(items), REDLINE_ROWS_PER_PAGE):
+        chunk = items[start:start + REDLINE_ROWS_PER_PAGE]
+        body = "".join(chunk)
+        pages.append((DIFF_CSS + f'<div style="background: rgba(0,0,0,0.2); border-radius: 8px; border: 1px solid #444; overflow: hidden;">{body}</div>', len(chunk)))
+    return pages
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def get_pair_diff(version_a_id, version_b_id):
+    # Diffs of consecutive versions are stored when the newer one is written.
+    # Any other pair is diffed on first view and stored for next time.
+    diff = get_version_diff(version_a_id, version_b_id)
+    if diff is None:
+        _, section_changes = compare_sections(get_specific_version_text(version_a_id), get_specific_version_text(version_b_id))
+        store_version_diff(version_a_id, version_b_id, section_changes)
+        diff = {'section_changes': section_changes, 'analysis': None, **diff_stats(section_changes)}
+    return diff
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def get_redline_pages(version_a_id, version_b_id):
+    # Stored versions never change, so a pair's rendering can be reused across reruns
+    return render_diff_pages(get_specific_version_text(version_a_id), get_specific_version_text(version_b_id),
+                             get_pair_diff(version_a_id, version_b_id)['section_changes'])
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def get_version_blame(version_id):
+    # Provenance is computed when a version is written; this is one row lookup
+    return get_blame(int(version_id))
+
+def render_blame(blame):
+    """Rule text with the version that introduced each line; the label is shown once per run of lines."""
+    rows = []
+    previous = None
+    for line in blame:
+        label = ""
+        if line['version_id'] != previous:
+            date = pd.to_datetime(line['check_date']).strftime('%b %d %Y') if line['check_date'] else ""
+            label = f"v.{line['version_id']} {date}"
+        previous = line['version_id']
+        rows.append(f'<div class="diff-row"><div class="diff-num blame">{html.escape(label)}</div>'
+                    f'<div class="diff-num">{line["line_no"]}</div><div class="diff-cell">{html.escape(line["text"])}</div></div>')
+    style = "<style>.diff-num.blame { width: 130px; text-align: left; padding-left: 8px; }</style>"
+    return DIFF_CSS + style + "".join(rows)
 
 # --- DEMO DATA INJECTOR ---
-def inject_demo_data(rule_id):
+def inject_demo_data(rule_id, url=None):
     common = """(a) Standards of Commercial Honor and Principles of Trade
 A member, in the conduct of its business, shall observe high standards of commercial honor and just and equitable principles of trade.
 
@@ -166,14 +255,10 @@ No member shall effect any transaction in, or induce the purchase or sale of, an
     added = """
 (c) New Requirement (Demo Update)
 This section simulates a new regulatory requirement added by the SEC to demonstrate the redline capabilities. Because this text is NOT in the baseline, it will appear GREEN."""
-    conn = sqlite3.connect('data/regulations.db')
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS rule_versions (id INTEGER PRIMARY KEY AUTOINCREMENT, rule_id TEXT, check_date TEXT, rule_text TEXT, change_summary TEXT)''')
-    c.execute("DELETE FROM rule_versions WHERE rule_id = ?", (rule_id,))
-    c.execute("INSERT INTO rule_versions (rule_id, check_date, rule_text, change_summary) VALUES (?, datetime('now', '-1 day'), ?, ?)", (rule_id, common, "Historical Baseline (Demo)"))
-    c.execute("INSERT INTO rule_versions (rule_id, check_date, rule_text, change_summary) VALUES (?, datetime('now'), ?, ?)", (rule_id, common + "\n" + added, "Live Audit (Demo)"))
-    conn.commit()
-    conn.close()
+    yesterday = (datetime.datetime.now() - datetime.timedelta(days=1)).isoformat()
+    delete_rule_history(rule_id, url)
+    log_new_version(rule_id, common, "Historical Baseline (Demo)", check_date=yesterday)
+    log_new_version(rule_id, common + "\n" + added, "Live Audit (Demo)")
     return True
 
 # --- APP LOGIC ---
@@ -186,7 +271,7 @@ selected_rule = {r['name']: r for r in rules}[selected_rule_name]
 
 if st.sidebar.button("Run Live Audit", type="primary"):
     with st.spinner("Scanning FINRA..."):
-        latest = download_rule(selected_rule['url'])
+        latest = download_rule(selected_rule['url'], selectors=selected_rule.get('selectors'))
         if not latest or len(latest) < 50 or "Error" in latest:
             st.error(f"Audit Failed: {latest}")
         else:
@@ -204,7 +289,7 @@ if st.sidebar.button("Run Live Audit", type="primary"):
 st.sidebar.markdown("---")
 st.sidebar.markdown("##### 🛠️ Demo Tools")
 if st.sidebar.button("⚠️ Load Test Data (Reset)"):
-    inject_demo_data(selected_rule['id'])
+    inject_demo_data(selected_rule['id'], selected_rule['url'])
     st.sidebar.success("System Reset: Demo Data Loaded.")
     st.rerun()
 
@@ -215,7 +300,7 @@ st.title(selected_rule_name)
 history_df = get_history(selected_rule['id'])
 
 # TABS (Updated with "About")
-tab_about, tab1, tab2, tab3 = st.tabs(["About", "Overview", "Redline Analysis", "Raw Text"])
+tab_about, tab1, tab2, tab3, tab_search, tab_timeline = st.tabs(["About", "Overview", "Redline Analysis", "Raw Text", "Search", "Timeline"])
 
 # --- TAB 0: ABOUT ---
 with tab_about:
@@ -275,10 +360,8 @@ with tab2:
         with col_a: ver_a_label = st.selectbox("Baseline Version", version_options, index=len(version_options)-1)
         with col_b: ver_b_label = st.selectbox("Comparison Version", version_options, index=0)
             
-        id_a = version_map[ver_a_label]
-        id_b = version_map[ver_b_label]
-        text_a = get_specific_version_text(id_a)
-        text_b = get_specific_version_text(id_b)
+        id_a = int(version_map[ver_a_label])
+        id_b = int(version_map[ver_b_label])
         
         # LEGEND
         st.markdown("""
@@ -288,12 +371,29 @@ with tab2:
         </div>
         """, unsafe_allow_html=True)
 
-        if text_a == text_b:
+        # Same content address, same text: no need to load or diff anything
+        blobs = history_df.set_index('id')['blob_hash']
+        same_text = id_a == id_b or (blobs[id_a] is not None and blobs[id_a] == blobs[id_b])
+        pages = get_redline_pages(id_a, id_b) if not same_text else []
+        if not pages:
             st.info("Versions are identical.")
         else:
-            diff_html = render_diff_html(text_a, text_b)
-            line_count = max(len(text_a.splitlines()), len(text_b.splitlines()))
-            dynamic_height = min(max(300, line_count * 25 + 50), 800)
+            diff = get_pair_diff(id_a, id_b)
+            if not diff['section_changes']:
+                st.caption("Formatting-only change: no subsection's text differs, only whitespace or line wrapping.")
+            else:
+                st.caption(f"+{diff['lines_added']} / −{diff['lines_removed']} lines in {diff['sections_changed']} subsection(s). "
+                           f"{summarize_sections(diff['section_changes'])}")
+            if diff['analysis']:
+                for key, label in (('added_entities', 'Added'), ('removed_entities', 'Removed')):
+                    found = {k: v for k, v in diff['analysis'].get(key, {}).items() if v}
+                    if found:
+                        st.caption(f"{label} entities — " + "; ".join(f"{k}: {', '.join(v)}" for k, v in found.items()))
+            page = 1
+            if len(pages) > 1:
+                page = st.number_input(f"Page (of {len(pages)})", min_value=1, max_value=len(pages), value=1, step=1)
+            diff_html, row_count = pages[page - 1]
+            dynamic_height = min(max(300, row_count * 25 + 50), 800)
             components.html(diff_html, height=dynamic_height, scrolling=True)
 
 # --- TAB 3: RAW TEXT ---
@@ -302,6 +402,50 @@ with tab3:
         st.info("No data available.")
     else:
         st.markdown("##### Current Legal Text")
-        try: selected_text_view = get_specific_version_text(version_map[ver_b_label])
-        except: selected_text_view = get_specific_version_text(history_df.iloc[0]['id'])
-        st.code(selected_text_view, language="text")
+        try: selected_version_id = int(version_map[ver_b_label])
+        except: selected_version_id = int(history_df.iloc[0]['id'])
+        if st.checkbox("Show when each line entered the rule"):
+            components.html(render_blame(get_version_blame(selected_version_id)), height=600, scrolling=True)
+        else:
+            st.code(get_specific_version_text(selected_version_id), language="text")
+
+# --- TAB 4: SEARCH ---
+with tab_search:
+    col_q, col_mode = st.columns([3, 1])
+    with col_q: query = st.text_input("Search every archived version", placeholder='e.g. "net capital" OR liquidity')
+    with col_mode: per_rule = st.checkbox("Best version per rule", value=True)
+    if query:
+        results = search_versions(query, limit=50, per_rule=per_rule)
+        if not results:
+            st.info("No archived version matches.")
+        rule_names = {r['id']: r['name'] for r in rules}
+        for result in results:
+            snippet = "".join(f"<mark>{html.escape(t)}</mark>" if matched else html.escape(t) for matched, t in result['snippet'])
+            st.markdown(f"""
+            <div style="padding: 10px 15px; margin-bottom: 10px;">
+                <strong>{html.escape(rule_names.get(result['rule_id'], result['rule_id']))}</strong>
+                <span style="color: #888; font-size: 12px;"> v.{result['version_id']} — {pd.to_datetime(result['check_date']).strftime('%b %d %Y %H:%M')}</span>
+                <div style="font-size: 13px; white-space: pre-wrap; margin-top: 5px;">{snippet}</div>
+            </div>
+            """, unsafe_allow_html=True)
+
+# --- TAB 5: PORTFOLIO TIMELINE ---
+with tab_timeline:
+    days = st.select_slider("Period", options=[7, 30, 90, 180, 365, 3650], value=90, format_func=lambda d: f"Last {d} days")
+    since = (datetime.date.today() - datetime.timedelta(days=days)).isoformat()
+    # Both read the per-rule, per-day summary table, never the versions themselves
+    daily = pd.DataFrame(get_daily_summary(since))
+    totals = pd.DataFrame(get_portfolio_summary(since))
+    if daily.empty:
+        st.info("No versions recorded in this period.")
+    else:
+        rule_names = {r['id']: r['name'] for r in rules}
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Rules Changed", int((totals['changes'] > 0).sum()))
+        col2.metric("Changes", int(totals['changes'].sum()))
+        col3.metric("Lines Changed", int(totals['lines_added'].sum() + totals['lines_removed'].sum()))
+        daily['lines_changed'] = daily['lines_added'] + daily['lines_removed']
+        daily['rule'] = daily['rule_id'].map(lambda r: rule_names.get(r, r))
+        st.bar_chart(daily.pivot_table(index='day', columns='rule', values='lines_changed', aggfunc='sum', fill_value=0))
+        totals.insert(1, 'name', totals['rule_id'].map(lambda r: rule_names.get(r, "")))
+        st.dataframe(totals, hide_index=True, use_container_width=True)
@@ -1,13 +1,23 @@
 # main.py
 
+import argparse
+import datetime
 import json
-from src.downloader import download_rule
-from src.database_manager import get_latest_version, log_new_version
-from src.comparator import compare_text
-from src.analyzer import analyze_changes
+import time
+from concurrent.futures import ThreadPoolExecutor
+from src.downloader import configure_politeness
+from src.checker import fetch_rule, check_page
+from src.database_manager import get_latest_check_dates, log_new_version, save_diff_analysis, get_portfolio_summary, count_tracked_rules, iter_tracked_rules, upsert_tracked_rules, rule_shard_key, migrate_storage, batched_writes, close_connections
+from src.sections import summarize_sections
+from src.analyzer import analyze_changes, analyze_changes_batch
 from src.reporter import generate_html_report  # <--- NEW IMPORT
+from src import metrics
+from src import http_archive
+from src.scheduler import RuleScheduler
+from src.pipeline import run_pipeline
+from src.discovery import run_discovery
 
-def load_rules():
+def load_rules_file():
     try:
         with open('data/tracked_rules.json', 'r') as f:
             return json.load(f)
@@ -15,55 +25,298 @@ def load_rules():
         print("Error: data/tracked_rules.json not found.")
         return []
 
-def process_rule(rule):
+def load_rules(shard=0, shards=1):
+    """
+    The rules to track: streamed from the tracked_rules table (see --discover)
+    once it has any, otherwise read from data/tracked_rules.json. With
+    shards > 1 only shard number `shard` (0-based) of the portfolio is returned.
+    """
+    if count_tracked_rules():
+        return iter_tracked_rules(shard, shards)
+    rules = load_rules_file()
+    if shards > 1:
+        rules = [rule for rule in rules if rule_shard_key(rule['id']) % shards == shard]
+    return rules
+
+def process_rule(rule, changed_rules=None, check_date=None):
+    """
+    Checks a single rule and returns its status for the run summary:
+    'baseline', 'unchanged', 'changed', 'failed' or 'blocked' (HTTP 403).
+
+    If a changed_rules dict is given, the rule's new version id and changes
+    are collected there, once the version is logged, for one batched NLP pass
+    at the end of the run instead of analysed here.
+    check_date stamps any new version (default: now; backfills pass the
+    recording time).
+    """
     rule_id = rule['id']
     rule_name = rule['name']
-    rule_url = rule['url']
-    
+
     print(f"\n--- Checking Rule: {rule_id} ({rule_name}) ---")
-    
-    latest_text = download_rule(rule_url)
-    if not latest_text:
-        print(f"[{rule_id}] Skipping due to download failure.")
-        return
 
-    last_version_text = get_latest_version(rule_id)
-    
-    if not last_version_text:
-        print(f"[{rule_id}] No baseline found. Initializing...")
-        log_new_version(rule_id, latest_text, summary="Initial Baseline Version")
-    else:
-        print(f"[{rule_id}] Baseline found. Comparing...")
-        changes = compare_text(last_version_text, latest_text)
-        
-        if changes:
-            print(f"[{rule_id}] ALERT: Changes detected!")
-            
-            # 1. NLP Analysis (Keep this for the database log)
-            analysis_results = analyze_changes(changes)
-            import json
-            analysis_json = json.dumps(analysis_results, indent=2)
-            
-            # 2. HTML Report Generation (NEW STEP)
-            report_path = generate_html_report(rule_id, rule_name, last_version_text, latest_text)
-            
-            # 3. Log to DB
-            log_new_version(rule_id, latest_text, summary=f"Changes detected. Report: {report_path}")
-            
-            print(f"[{rule_id}] HTML Redline Report generated at: {report_path}")
-            
-        else:
-            print(f"[{rule_id}] No changes detected.")
+    # Fetch, parse, hash and section diff are shared with the pipeline mode (src/checker.py)
+    baseline_exists, page = fetch_rule(rule)
+    status, details = check_page(rule, baseline_exists, page, check_date)
+    if details is None:
+        return status
+    section_changes = details['section_changes']
+
+    # 1. NLP Analysis (stored with the version's diff)
+    analysis_results = None
+    if changed_rules is None:
+        with metrics.span('nlp'):
+            analysis_results = analyze_changes(details['changes'])
+
+    # 2. HTML Report Generation (NEW STEP)
+    with metrics.span('report'):
+        report_path = generate_html_report(rule_id, rule_name, details['old_text'], details['new_text'],
+                                           section_changes=section_changes)
+
+    # 3. Log to DB, together with the diff and analysis for this version pair
+    # The page's validators are saved with the version, so a failure up to here is retried next run
+    with metrics.span('db_write'):
+        version_id = log_new_version(rule_id, details['new_text'],
+                                     summary=f"Changes detected ({summarize_sections(section_changes)}). Report: {report_path}",
+                                     section_changes=section_changes, analysis=analysis_results,
+                                     check_date=check_date, fetch_state=details['fetch_state'])
+    if version_id is None:
+        return 'failed'
+    if changed_rules is not None:
+        changed_rules[rule_id] = (version_id, details['changes'])
+
+    print(f"[{rule_id}] HTML Redline Report generated at: {report_path}")
+    return 'changed'
+
+def _timed_process_rule(rule, changed_rules=None, check_date=None):
+    """Runs process_rule and returns (rule_id, status, seconds). Never raises."""
+    start = time.perf_counter()
+    try:
+        with metrics.span('rule', rule_id=rule['id']):
+            status = process_rule(rule, changed_rules, check_date)
+    except Exception as e:
+        print(f"[{rule['id']}] Unexpected error: {e}")
+        status = 'failed'
+    metrics.incr(f"rules_{status}")
+    return rule['id'], status, time.perf_counter() - start
+
+def print_summary(results, total_seconds):
+    print("\n=== Run Summary ===")
+    for rule_id, status, seconds in results:
+        print(f"{rule_id:<14} {status:<10} {seconds:6.2f}s")
+    counts = {}
+    for _, status, _ in results:
+        counts[status] = counts.get(status, 0) + 1
+    totals = ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+    print(f"Checked {len(results)} rules in {total_seconds:.2f}s ({totals or 'nothing to do'})")
+    counters = metrics.snapshot()['counters']
+    if 'entity_cache_hits' in counters:
+        print(f"Entity cache: {counters['entity_cache_hits']} hits, {counters.get('entity_cache_misses', 0)} misses, "
+              f"{counters.get('entity_cache_evictions', 0)} evictions")
+
+def report_entities(analyses):
+    """Prints the entities found in each changed rule."""
+    for rule_id, analysis in analyses.items():
+        for key, label in (('added_entities', 'Added'), ('removed_entities', 'Removed')):
+            found = {k: v for k, v in analysis[key].items() if v}
+            if found:
+                print(f"[{rule_id}] {label}: " + "; ".join(f"{k}: {', '.join(v)}" for k, v in found.items()))
+
+def run_tracker(workers=1, nlp_processes=1, metrics_jsonl=None, metrics_prom=None, rules=None,
+                pipeline=False, parse_workers=2, cpu_processes=2, check_date=None, shard=0, shards=1):
+    """
+    Checks every tracked rule, or one shard of them (shard of shards), or just `rules`, if given.
+    With workers > 1 the rules are fetched
+    concurrently; per-host politeness limits still apply (see src/downloader.py).
+    Changed rules are analysed together in one batched NLP pass at the end.
+
+    With pipeline=True the run is staged instead (see src/pipeline.py):
+    `workers` fetch threads, `parse_workers` parse/diff threads and
+    `cpu_processes` worker processes for NLP and reports.
 
-def run_tracker():
+    Stage timings and counters (see src/metrics.py) are appended to
+    metrics_jsonl and/or written to metrics_prom when those paths are given.
+    """
     print("=== Starting SEC/FINRA Rule Tracker Portfolio Check ===")
-    rules = load_rules()
-    print(f"Loaded {len(rules)} rules to track.")
-    
-    for rule in rules:
-        process_rule(rule)
-        
+    metrics.reset()
+    if rules is None:
+        rules = load_rules(shard, shards)
+        count = len(rules) if isinstance(rules, list) else count_tracked_rules(shard, shards)
+        print(f"Loaded {count} rules to track" + (f" (shard {shard}/{shards})." if shards > 1 else "."))
+
+    start = time.perf_counter()
+    changed_rules = {}
+    # Each rule's writes commit on their own: a transaction held across the
+    # (rate-limited) fetches would lock out the dashboard for the whole run
+    if pipeline:
+        results, analyses = run_pipeline(rules, fetch_workers=workers, parse_workers=parse_workers,
+                                         cpu_processes=cpu_processes, check_date=check_date)
+        report_entities(analyses)
+    elif workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(lambda rule: _timed_process_rule(rule, changed_rules, check_date), rules))
+    else:
+        results = [_timed_process_rule(rule, changed_rules, check_date) for rule in rules]
+
+    if changed_rules:
+        try:
+            with metrics.span('nlp'):
+                analyses = analyze_changes_batch({rule_id: changes for rule_id, (_, changes) in changed_rules.items()},
+                                                 n_process=nlp_processes)
+            report_entities(analyses)
+            # The versions were logged before the batch ran; attach the results to their diffs
+            with batched_writes():
+                for rule_id, analysis in analyses.items():
+                    save_diff_analysis(changed_rules[rule_id][0], analysis)
+        except (OSError, ImportError):
+            print("Skipping NLP analysis: spaCy model unavailable.")
+
     print("\n=== Portfolio Check Complete ===")
+    print_summary(results, time.perf_counter() - start)
+    if metrics_jsonl:
+        print(f"Metrics appended to {metrics.write_jsonl(metrics_jsonl)}")
+    if metrics_prom:
+        print(f"Metrics written to {metrics.write_prometheus(metrics_prom)}")
+    return results
+
+def run_daemon(workers=1, nlp_processes=1, metrics_jsonl=None, metrics_prom=None, shard=0, shards=1, **stage_options):
+    """
+    Runs until interrupted, checking each rule when the adaptive scheduler
+    (src/scheduler.py) says it is due instead of all rules at a fixed pace.
+    stage_options (pipeline, parse_workers, cpu_processes) go to run_tracker.
+    """
+    rules = list(load_rules(shard, shards))
+    if not rules:
+        return
+    scheduler = RuleScheduler(rules)
+    print(f"=== Daemon mode: scheduling {len(rules)} rules (Ctrl+C to stop) ===")
+    try:
+        while True:
+            due = scheduler.pop_due()
+            if not due:
+                time.sleep(max(0.0, scheduler.next_due() - time.time()))
+                continue
+            results = run_tracker(workers, nlp_processes, metrics_jsonl, metrics_prom, rules=due, **stage_options)
+            for rule_id, status, _ in results:
+                delay = scheduler.record(rule_id, status)
+                print(f"[{rule_id}] Next check in {delay / 3600:.1f}h")
+    except KeyboardInterrupt:
+        print("\nDaemon stopped.")
+    finally:
+        close_connections()
+
+def run_backfill(**options):
+    """
+    Replays every recording session in the HTTP archive, oldest first: one
+    tracker run per session, serving each URL as it was recorded then, with
+    new versions dated at the recording time. Needs replay mode configured.
+
+    Version chains (deltas, diffs, provenance) follow insertion order, so a
+    rule that already has versions newer than a session is skipped for that
+    session rather than given a backdated version after them.
+    """
+    archive_dir = http_archive.ARCHIVE_DIR
+    snapshots = http_archive.sessions()
+    rules = list(load_rules(options.pop('shard', 0), options.pop('shards', 1)))
+    print(f"=== Backfill: {len(snapshots)} recorded session(s) in {archive_dir} ===")
+    results = []
+    for session, last_recorded in snapshots:
+        check_date = http_archive.to_iso(last_recorded)
+        latest = get_latest_check_dates()
+        due = [rule for rule in rules if latest.get(rule['id'], "") <= check_date]
+        if len(due) < len(rules):
+            print(f"Backfill: skipping {len(rules) - len(due)} rule(s) with versions newer than {check_date}.")
+        if not due:
+            continue
+        http_archive.configure_archive(archive_dir, 'replay', as_of=check_date)
+        results = run_tracker(check_date=check_date, rules=due, **options)
+    return results
+
+def print_timeline(days=90):
+    """Portfolio report: what changed in every tracked rule over the last `days` days."""
+    since = (datetime.date.today() - datetime.timedelta(days=days)).isoformat()
+    names = {rule['id']: rule['name'] for rule in load_rules()}
+    rows = get_portfolio_summary(since)
+    print(f"=== Changes since {since} ({days} days) ===")
+    print(f"{'Rule':<14} {'Name':<30} {'Changes':>7} {'+Lines':>7} {'-Lines':>7} {'Sections':>8}  Last change")
+    for row in rows:
+        print(f"{row['rule_id']:<14} {names.get(row['rule_id'], '')[:30]:<30} {row['changes']:>7} "
+              f"{row['lines_added']:>7} {row['lines_removed']:>7} {row['sections_changed']:>8}  {row['last_day']}")
+    changed = sum(1 for row in rows if row['changes'])
+    print(f"{changed} of {len(names) or len(rows)} rules changed, {sum(row['changes'] for row in rows)} changes in total.")
+
+def parse_shard(value):
+    """'K/N' -> (K, N): shard K (0-based) of N."""
+    try:
+        shard, shards = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected K/N, e.g. 0/4")
+    if not 0 <= shard < shards:
+        raise argparse.ArgumentTypeError("K must be between 0 and N-1")
+    return shard, shards
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="SEC/FINRA Rule Tracker")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of rules to check concurrently (default: 1)")
+    parser.add_argument("--rate", type=float, default=None,
+                        help="Max requests per second to any single host")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="Max simultaneous requests to any single host")
+    parser.add_argument("--nlp-processes", type=int, default=1,
+                        help="spaCy worker processes for the end-of-run NLP batch")
+    parser.add_argument("--migrate-storage", choices=["blob", "delta", "text"], default=None,
+                        help="Re-encode all stored versions in this storage mode and exit")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Run fetching, parsing/diffing and NLP/reports as separate concurrent stages")
+    parser.add_argument("--parse-workers", type=int, default=2,
+                        help="Parse/diff threads in --pipeline mode (default: 2)")
+    parser.add_argument("--cpu-processes", type=int, default=2,
+                        help="Worker processes for NLP and reports in --pipeline mode (default: 2)")
+    parser.add_argument("--discover", nargs="*", metavar="URL", default=None,
+                        help="Crawl rulebook index pages (default: the FINRA rulebook) into the tracked_rules table and exit")
+    parser.add_argument("--shard", type=parse_shard, metavar="K/N", default=(0, 1),
+                        help="Only check shard K (0-based) of N, so several machines can split the portfolio")
+    parser.add_argument("--timeline", type=int, metavar="DAYS", default=None,
+                        help="Print what changed across all rules in the last DAYS days and exit")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Keep running and poll each rule on its own adaptive schedule")
+    parser.add_argument("--record", metavar="DIR", default=None,
+                        help="Save every HTTP response to this archive directory while running")
+    parser.add_argument("--replay", metavar="DIR", default=None,
+                        help="Serve pages from this archive directory instead of the network")
+    parser.add_argument("--replay-at", metavar="TIMESTAMP", default=None,
+                        help="With --replay: use the newest recording at or before this ISO timestamp")
+    parser.add_argument("--backfill", action="store_true",
+                        help="With --replay: run once per recorded session, oldest first, dating versions at recording time")
+    parser.add_argument("--metrics-jsonl", default=None,
+                        help="Append per-stage timing spans and counters for each run to this JSON-lines file")
+    parser.add_argument("--metrics-prom", default=None,
+                        help="Write the run's metrics to this file in Prometheus text format")
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    run_tracker()
\ No newline at end of file
+    args = parse_args()
+    if args.migrate_storage:
+        migrate_storage(args.migrate_storage)
+    elif args.timeline is not None:
+        print_timeline(args.timeline)
+    elif args.discover is not None:
+        configure_politeness(args.rate, args.max_in_flight)
+        if not count_tracked_rules():
+            # Keep the hand-maintained rules (names, selectors) when switching over to the table
+            upsert_tracked_rules(load_rules_file(), source='json')
+        run_discovery(args.discover or None, workers=args.workers)
+    else:
+        configure_politeness(args.rate, args.max_in_flight)
+        if args.replay:
+            http_archive.configure_archive(args.replay, 'replay', as_of=args.replay_at)
+        elif args.record:
+            http_archive.configure_archive(args.record, 'record')
+        if args.backfill and args.replay:
+            run = run_backfill
+        else:
+            run = run_daemon if args.daemon else run_tracker
+        run(workers=args.workers, nlp_processes=args.nlp_processes,
+            metrics_jsonl=args.metrics_jsonl, metrics_prom=args.metrics_prom,
+            pipeline=args.pipeline, parse_workers=args.parse_workers, cpu_processes=args.cpu_processes,
+            shard=args.shard[0], shards=args.shard[1])
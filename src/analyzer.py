@@ -1,14 +1,55 @@
 # src/analyzer.py
 
-import spacy
+import hashlib
+from functools import lru_cache
 from typing import List, Dict
+from src.database_manager import get_cached_entities, store_cached_entities
+from src import metrics
 
-# Load the small English model (must be done only once)
-try:
-    nlp = spacy.load("en_core_web_sm")
-except OSError:
-    print("Error: spaCy model 'en_core_web_sm' not found. Did you run 'python3 -m spacy download en_core_web_sm'?")
-    # Exit or handle error
+SPACY_MODEL = "en_core_web_sm"
+
+# We only need named entities; these components are switched off after loading
+NON_NER_COMPONENTS = ["tagger", "parser", "senter", "attribute_ruler", "lemmatizer", "morphologizer"]
+
+@lru_cache(maxsize=1)
+def get_nlp():
+    """
+    Loads the spaCy model on first use and caches it for the rest of the process.
+    spaCy itself is imported here too, so runs where nothing changed never pay for it.
+    Everything NER doesn't depend on is disabled.
+    """
+    import spacy
+    try:
+        nlp = spacy.load(SPACY_MODEL)
+    except OSError:
+        print(f"Error: spaCy model '{SPACY_MODEL}' not found. Did you run 'python3 -m spacy download {SPACY_MODEL}'?")
+        raise
+
+    for name in NON_NER_COMPONENTS:
+        if name in nlp.pipe_names:
+            nlp.disable_pipe(name)
+    # The shared tok2vec feeds tagger/parser; in the small model NER has its own
+    if "tok2vec" in nlp.pipe_names and "ner" not in getattr(nlp.get_pipe("tok2vec"), "listening_components", []):
+        nlp.disable_pipe("tok2vec")
+    return nlp
+
+def _split_changes(changed_lines: List[str]):
+    """Returns (added paragraphs, removed paragraphs) from compare_text output, skipping block markers."""
+    added = [line[2:].strip() for line in changed_lines if line.startswith('+ ')]
+    removed = [line[2:].strip() for line in changed_lines if line.startswith('- ')]
+    return [p for p in added if p], [p for p in removed if p]
+
+def paragraph_hash(paragraph: str) -> str:
+    """Cache key for a paragraph: whitespace-insensitive SHA-256."""
+    return hashlib.sha256(" ".join(paragraph.split()).encode('utf-8')).hexdigest()
+
+def merge_entities(entity_dicts) -> Dict[str, List[str]]:
+    """Unions several extract_entities() results into one, deduplicated and sorted."""
+    merged = {}
+    for entities in entity_dicts:
+        for label, values in entities.items():
+            merged.setdefault(label, set()).update(values)
+    return {label: sorted(values) for label, values in merged.items()}
 
 def analyze_changes(changed_lines: List[str]) -> Dict[str, any]:
     """
@@ -21,31 +62,91 @@ def analyze_changes(changed_lines: List[str]) -> Dict[str, any]:
     Returns:
         A dictionary containing the summary and extracted entities.
     """
-    print("\nStarting NLP analysis of rule changes...")
-    
-    analysis = {
-        'summary': "Rule change detected. NLP analysis completed.",
-        'added_entities': {},
-        'removed_entities': {},
-        'raw_changes': changed_lines
-    }
-    
-    # Concatenate all new (+) and removed (-) lines separately for spaCy processing
-    added_text = " ".join([line[2:] for line in changed_lines if line.startswith('+')])
-    removed_text = " ".join([line[2:] for line in changed_lines if line.startswith('-')])
-
-    # Process ADDED text
-    if added_text:
-        doc_added = nlp(added_text)
-        analysis['added_entities'] = extract_entities(doc_added)
-        
-    # Process REMOVED text
-    if removed_text:
-        doc_removed = nlp(removed_text)
-        analysis['removed_entities'] = extract_entities(doc_removed)
-        
-    print("NLP analysis finished.")
-    return analysis
+    return analyze_changes_batch({None: changed_lines})[None]
+
+def analyze_changes_batch(changes_by_rule: Dict[str, List[str]], n_process: int = 1,
+                          batch_size: int = 32) -> Dict[str, Dict[str, any]]:
+    """
+    Runs the NLP analysis for many changed rules at once, streaming every
+    added/removed text through a single nlp.pipe call.
+
+    Args:
+        changes_by_rule: rule_id -> compare_text output for that rule.
+        n_process: spaCy worker processes (>1 only pays off for big batches).
+        batch_size: texts per spaCy batch.
+
+    Returns:
+        rule_id -> the same dictionary analyze_changes returns.
+    """
+    print(f"\nStarting NLP analysis of {len(changes_by_rule)} changed rule(s)...")
+
+    plan, missing = plan_analysis(changes_by_rule)
+    fresh = {}
+    if missing:
+        fresh = dict(zip(missing, extract_paragraph_entities(list(missing.values()), n_process, batch_size)))
+    results = complete_analysis(plan, fresh)
+
+    print(f"NLP analysis finished ({len(plan['known'])} paragraphs from cache, {len(missing)} analysed).")
+    return results
+
+def plan_analysis(changes_by_rule: Dict[str, List[str]]):
+    """
+    First half of analyze_changes_batch: splits the changes into paragraphs
+    and looks them up in the entity cache. Returns (plan, missing), where
+    missing maps paragraph hash -> paragraph text for the paragraphs that
+    still need the model (see extract_paragraph_entities).
+    """
+    results = {}
+    paragraphs_by_target = {}
+    for rule_id, changed_lines in changes_by_rule.items():
+        results[rule_id] = {
+            'summary': "Rule change detected. NLP analysis completed.",
+            'added_entities': {},
+            'removed_entities': {},
+            'raw_changes': changed_lines
+        }
+        # New (+) and removed (-) paragraphs are analysed separately
+        added, removed = _split_changes(changed_lines)
+        paragraphs_by_target[(rule_id, 'added_entities')] = added
+        paragraphs_by_target[(rule_id, 'removed_entities')] = removed
+
+    # Only paragraphs spaCy has never seen (in any rule, any run) go through the model
+    unique = {}
+    for paragraphs in paragraphs_by_target.values():
+        for paragraph in paragraphs:
+            unique.setdefault(paragraph_hash(paragraph), paragraph)
+    known = get_cached_entities(list(unique))
+    missing = {h: unique[h] for h in unique if h not in known}
+    # Paragraph entity cache hit/miss counters, exported with the run's metrics
+    metrics.incr('entity_cache_hits', len(known))
+    metrics.incr('entity_cache_misses', len(missing))
+
+    plan = {'results': results, 'paragraphs_by_target': paragraphs_by_target, 'known': known}
+    return plan, missing
+
+def extract_paragraph_entities(paragraphs: List[str], n_process: int = 1, batch_size: int = 32) -> List[Dict[str, List[str]]]:
+    """
+    Runs NER over the paragraphs, one extract_entities() dict per paragraph.
+    Touches no database, so it is safe to run in a worker process.
+    """
+    docs = get_nlp().pipe(paragraphs, n_process=n_process, batch_size=batch_size)
+    return [extract_entities(doc) for doc in docs]
+
+def complete_analysis(plan, fresh: Dict[str, Dict[str, List[str]]]) -> Dict[str, Dict[str, any]]:
+    """
+    Second half of analyze_changes_batch: caches the freshly extracted
+    entities (paragraph hash -> entities) and merges them per rule.
+    """
+    known = dict(plan['known'])
+    if fresh:
+        metrics.incr('entity_cache_evictions', store_cached_entities(fresh))
+        known.update(fresh)
+
+    results = plan['results']
+    for (rule_id, key), paragraphs in plan['paragraphs_by_target'].items():
+        if paragraphs:
+            results[rule_id][key] = merge_entities(known[paragraph_hash(p)] for p in paragraphs)
+    return results
 
 def extract_entities(doc) -> Dict[str, List[str]]:
     """Helper function to extract named entities of interest."""
@@ -0,0 +1,84 @@
+# src/checker.py
+
+from src.downloader import fetch_page, parse_page, remember_page, is_download_error, NOT_MODIFIED
+from src.database_manager import get_latest_version, get_latest_hash, has_baseline, log_new_version
+from src.comparator import content_hash
+from src.sections import compare_sections, summarize_sections
+from src import metrics
+
+# The per-rule check shared by the sequential tracker (main.process_rule) and
+# the staged pipeline (src/pipeline.py), so both modes report the same
+# statuses and time the same stages:
+#
+#   fetch - the (conditional) download, after a 'db_read' baseline lookup
+#   check - parsing, baseline init, the content-hash fast path and the section diff
+#
+# What happens to a changed rule afterwards (NLP, report, logging the
+# version) differs per mode and stays with the caller.
+
+
+def fetch_rule(rule):
+    """(baseline_exists, page) for a rule, page being a fetch_page() result."""
+    with metrics.span('db_read', rule_id=rule['id']):
+        baseline_exists = has_baseline(rule['id'])
+    # Conditional fetch only makes sense once there is a baseline to fall back on
+    with metrics.span('fetch', rule_id=rule['id']):
+        page = fetch_page(rule['url'], conditional=baseline_exists)
+    return baseline_exists, page
+
+
+def check_page(rule, baseline_exists, page, check_date=None):
+    """
+    Checks one fetched page against the stored versions. Returns (status, None),
+    or ('changed', details) for a rule that goes on to analysis, details being
+    a dict with old_text, new_text, changes, section_changes and fetch_state
+    (pass it to log_new_version with the new version).
+    """
+    with metrics.span('check', rule_id=rule['id']):
+        return _check(rule, baseline_exists, page, check_date)
+
+
+def _check(rule, baseline_exists, page, check_date):
+    rule_id = rule['id']
+    if page is NOT_MODIFIED:
+        print(f"[{rule_id}] Page not modified since last check.")
+        return 'unchanged', None
+    latest_text = page if isinstance(page, str) else parse_page(page, rule.get('selectors'))
+    if is_download_error(latest_text):
+        print(f"[{rule_id}] Skipping due to download failure: {latest_text}")
+        return ('blocked' if latest_text.startswith("Error 403") else 'failed'), None
+
+    if not baseline_exists:
+        print(f"[{rule_id}] No baseline found. Initializing...")
+        with metrics.span('db_write'):
+            version_id = log_new_version(rule_id, latest_text, summary="Initial Baseline Version",
+                                         check_date=check_date, fetch_state=page)
+        return ('baseline' if version_id is not None else 'failed'), None
+
+    with metrics.span('db_read'):
+        stored_hash = get_latest_hash(rule_id)
+    with metrics.span('hash'):
+        latest_hash = content_hash(latest_text)
+    if stored_hash == latest_hash:
+        # Fast path: one indexed lookup, no need to load or diff the stored text
+        print(f"[{rule_id}] No changes detected (content hash match).")
+        remember_page(page)
+        return 'unchanged', None
+
+    with metrics.span('db_read'):
+        last_version_text = get_latest_version(rule_id)
+    # Only the subsections whose hash changed are diffed, analysed and rendered
+    with metrics.span('compare'):
+        changes, section_changes = compare_sections(last_version_text, latest_text)
+    if not section_changes:
+        print(f"[{rule_id}] No changes detected.")
+        remember_page(page)
+        return 'unchanged', None
+
+    print(f"[{rule_id}] ALERT: Changes detected! {summarize_sections(section_changes)}")
+    # The validators are saved with the version, once analysis and report have succeeded
+    fetch_state = {key: page[key] for key in ('url', 'etag', 'last_modified', 'body_hash')}
+    return 'changed', {'old_text': last_version_text, 'new_text': latest_text, 'changes': changes,
+                       'section_changes': section_changes, 'fetch_state': fetch_state}
+
+# End of checker.py
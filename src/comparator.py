@@ -1,36 +1,50 @@
 # src/comparator.py
 
-import difflib
+import hashlib
+import re
 from typing import List
+from src.diff_engine import diff_opcodes
 
-def compare_text(old_text: str, new_text: str) -> List[str]:
+# Page chrome that shows up in scraped rule text but is not part of the rule.
+# Lines matching these are ignored when fingerprinting a version.
+BOILERPLATE_PATTERNS = [
+    re.compile(r'^(print|share|email|back to top|skip to main content)$', re.IGNORECASE),
+    re.compile(r'^(last updated|page last modified)\b.*$', re.IGNORECASE),
+]
+
+def normalize_text(text: str) -> str:
     """
-    Compares two strings of text line-by-line and returns a list of lines
-    that represent additions or deletions (the changes).
+    Normalizes rule text for fingerprinting: collapses runs of whitespace
+    (including non-breaking spaces), drops blank lines and known boilerplate.
+    """
+    lines = []
+    for line in text.splitlines():
+        line = " ".join(line.replace('\xa0', ' ').split())
+        if not line or any(p.match(line) for p in BOILERPLATE_PATTERNS):
+            continue
+        lines.append(line)
+    return "\n".join(lines)
 
-    Args:
-        old_text: The baseline text fetched from the database.
-        new_text: The newly downloaded text from the website.
+def content_hash(text: str) -> str:
+    """SHA-256 of the normalized text. Equal hashes mean 'no meaningful change'."""
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
 
-    Returns:
-        A list of strings, where each string is a line showing a difference,
-        prefixed with '+' (addition) or '-' (deletion).
+def diff_lines(old_lines: List[str], new_lines: List[str]) -> List[str]:
     """
-    print("Starting comparison of old and new rule versions...")
-    
-    # 1. Split text into lists of lines
-    old_lines = old_text.splitlines()
-    new_lines = new_text.splitlines()
+    The changed lines between two lists of lines, prefixed with '- ' or '+ ';
+    replaced runs are wrapped in REPLACED BLOCK marker lines.
+    """
+    # Use the shared diff engine (patience/Myers) to find differences
+    return opcode_lines(old_lines, new_lines, diff_opcodes(old_lines, new_lines))
 
-    # 2. Use difflib SequenceMatcher to find differences
-    differ = difflib.SequenceMatcher(None, old_lines, new_lines)
-    
+def opcode_lines(old_lines: List[str], new_lines: List[str], opcodes) -> List[str]:
+    """diff_lines() output for opcodes that were already computed (e.g. stored ones)."""
     changed_lines = []
     
-    # 3. Iterate through the comparisons and capture changes
-    #    The 'opcodes' method yields differences as tuples: (tag, i1, i2, j1, j2)
+    # Iterate through the comparisons and capture changes
+    #    The opcodes are tuples like difflib's: (tag, i1, i2, j1, j2)
     #    Tags are 'replace', 'delete', 'insert', 'equal'
-    for tag, i1, i2, j1, j2 in differ.get_opcodes():
+    for tag, i1, i2, j1, j2 in opcodes:
         if tag == 'equal':
             continue
         
@@ -53,6 +67,26 @@ def compare_text(old_text: str, new_text: str) -> List[str]:
                 changed_lines.append(f"+ {line}")
             changed_lines.append(f"--- END REPLACED BLOCK ---")
 
+    return changed_lines
+
+def compare_text(old_text: str, new_text: str) -> List[str]:
+    """
+    Compares two strings of text line-by-line and returns a list of lines
+    that represent additions or deletions (the changes).
+
+    Args:
+        old_text: The baseline text fetched from the database.
+        new_text: The newly downloaded text from the website.
+
+    Returns:
+        A list of strings, where each string is a line showing a difference,
+        prefixed with '+' (addition) or '-' (deletion).
+    """
+    print("Starting comparison of old and new rule versions...")
+    
+    # Split text into lists of lines and diff them
+    changed_lines = diff_lines(old_text.splitlines(), new_text.splitlines())
+
     print(f"Comparison finished. Found {len(changed_lines)} lines of changes.")
     return changed_lines
 
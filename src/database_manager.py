@@ -2,39 +2,578 @@
 
 import sqlite3
 import datetime
+import hashlib
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+from src.comparator import content_hash
+from src.sections import compare_sections, diff_stats
+from src.provenance import carry_origins, encode_runs, decode_runs
+from src.delta import FULL, DELTA, BLOB, encode_full, encode_delta, decode_full, apply_delta
 
 # Define the path to the database file in the 'data' directory
 DB_PATH = 'data/regulations.db'
 
+# How new versions are stored:
+#   'blob'  - the row references its text by content hash in text_blobs, where
+#             every distinct text is stored once: identical and reverted versions
+#             (of any rule) share one blob. New blobs are deltas against the
+#             rule's previous blob, with a full keyframe every KEYFRAME_INTERVAL.
+#   'delta' - compressed line delta against the previous version, with a
+#             compressed full keyframe every KEYFRAME_INTERVAL versions
+#   'text'  - plain full text in rule_text (the original schema)
+STORAGE_MODE = 'blob'
+KEYFRAME_INTERVAL = 10
+
+# Upper bound on cached paragraph -> entities rows; least recently used go first
+ENTITY_CACHE_MAX_ENTRIES = 50000
+
+# Inside batched_writes(), commit after this many write operations
+BATCH_SIZE = 200
+
+# Full-text search: characters of context in a snippet, and the most hits
+# that are ranked by relevance (larger result sets are listed newest first)
+SEARCH_SNIPPET_CHARS = 160
+SEARCH_RANK_LIMIT = 2000
+# Cleared if this SQLite build has no FTS5; versions are then not indexed
+_search_available = True
+
+# --- Connection management ---
+# Readers get one long-lived connection per thread. All writes go through a
+# single shared writer connection guarded by a lock, so concurrent tracker
+# threads never fight over SQLite's write lock, and WAL mode lets the
+# dashboard keep reading while the tracker writes.
+_local = threading.local()
+_write_lock = threading.RLock()
+_writer = None
+_writer_path = None
+_batch_depth = 0
+_pending_writes = 0
+_setup_paths = set()
+_setup_lock = threading.Lock()
+
+def _open_connection(path, check_same_thread=True):
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=check_same_thread)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("PRAGMA temp_store=MEMORY;")
+    conn.execute("PRAGMA cache_size=-16000;")  # ~16 MB page cache
+    return conn
+
+def _get_writer():
+    """The shared writer connection for DB_PATH (caller must hold _write_lock)."""
+    global _writer, _writer_path
+    if _writer is None or _writer_path != DB_PATH:
+        if _writer is not None:
+            _writer.close()
+        # Autocommit mode: transactions are managed explicitly in _write_transaction
+        _writer = _open_connection(DB_PATH, check_same_thread=False)
+        _writer.isolation_level = None
+        _writer_path = DB_PATH
+    return _writer
+
+def _ensure_setup():
+    if DB_PATH not in _setup_paths:
+        with _setup_lock:
+            if DB_PATH not in _setup_paths:
+                setup_database()
+
 def create_connection():
-    """Create a database connection."""
-    conn = None
+    """Return this thread's reusable read connection (do not close it)."""
+    _ensure_setup()
+    conn = getattr(_local, 'conn', None)
     try:
-        conn = sqlite3.connect(DB_PATH)
+        if conn is None or _local.path != DB_PATH:
+            if conn is not None:
+                conn.close()
+            conn = _open_connection(DB_PATH)
+            _local.conn, _local.path = conn, DB_PATH
         return conn
     except sqlite3.Error as e:
         print(f"Error connecting to database: {e}")
-    return conn
+    return None
+
+def close_connections():
+    """Close the writer and this thread's reader (e.g. before deleting the DB file)."""
+    global _writer, _writer_path
+    with _write_lock:
+        if _writer is not None:
+            if _writer.in_transaction:
+                _writer.execute("COMMIT;")
+            _writer.close()
+            _writer, _writer_path = None, None
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+@contextmanager
+def _write_transaction():
+    """
+    Yields the writer connection for one write operation. Outside a batch the
+    operation is committed on its own; inside batched_writes() it joins the
+    open transaction (as a savepoint, so a failed operation is undone alone).
+    """
+    global _pending_writes
+    _ensure_setup()
+    with _write_lock:
+        conn = _get_writer()
+        if _batch_depth == 0:
+            conn.execute("BEGIN IMMEDIATE;")
+            try:
+                yield conn
+            except Exception:
+                conn.execute("ROLLBACK;")
+                raise
+            conn.execute("COMMIT;")
+            return
+
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE;")
+        conn.execute("SAVEPOINT write_op;")
+        try:
+            yield conn
+        except Exception:
+            conn.execute("ROLLBACK TO write_op;")
+            conn.execute("RELEASE write_op;")
+            raise
+        conn.execute("RELEASE write_op;")
+        _pending_writes += 1
+        if _pending_writes >= BATCH_SIZE:
+            conn.execute("COMMIT;")
+            _pending_writes = 0
+
+@contextmanager
+def batched_writes():
+    """
+    Groups every write made inside the block (from any thread) into as few
+    transactions as possible: one commit per BATCH_SIZE writes and one at the end.
+
+        with batched_writes():
+            for version_id, analysis in analyses.items():
+                save_diff_analysis(version_id, analysis)
+
+    SQLite's write lock is held from the first write until the next commit,
+    so keep network fetches and other slow work out of the block: every
+    other writer (e.g. the dashboard) waits on it meanwhile.
+    """
+    global _batch_depth, _pending_writes
+    with _write_lock:
+        _batch_depth += 1
+    try:
+        yield
+    finally:
+        with _write_lock:
+            _batch_depth -= 1
+            if _batch_depth == 0 and _writer is not None and _writer.in_transaction:
+                _writer.execute("COMMIT;")
+                _pending_writes = 0
 
 def setup_database():
-    """Create the table needed to store regulatory rule versions."""
+    """Create the tables needed to store regulatory rule versions."""
+    try:
+        with _write_lock:
+            conn = _get_writer()
+            conn.execute("BEGIN IMMEDIATE;")
+            try:
+                # UPDATED: Added 'rule_id' column to track different rules separately
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS rule_versions (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        rule_id TEXT NOT NULL,
+                        rule_text TEXT NOT NULL,
+                        change_summary TEXT,
+                        check_date TEXT NOT NULL
+                    );
+                """)
+                migrate_database(conn)
+                # HTTP validators and raw body fingerprint of the last fetch per URL,
+                # used by the downloader for conditional GETs
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS fetch_state (
+                        url TEXT PRIMARY KEY,
+                        etag TEXT,
+                        last_modified TEXT,
+                        body_hash TEXT,
+                        fetch_date TEXT NOT NULL
+                    );
+                """)
+                # Paragraph hash -> extracted entities (JSON), shared by all rules
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS entity_cache (
+                        para_hash TEXT PRIMARY KEY,
+                        entities TEXT NOT NULL,
+                        last_used REAL NOT NULL
+                    );
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_entity_cache_last_used ON entity_cache (last_used);")
+                # Diff of a version pair, computed once when the newer version is written:
+                # section changes with their opcodes (JSON, see sections.compare_sections),
+                # line/section counts and the NLP analysis (JSON, NULL until it has run)
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS version_diffs (
+                        from_version INTEGER NOT NULL,
+                        to_version INTEGER NOT NULL,
+                        section_changes TEXT NOT NULL,
+                        lines_added INTEGER NOT NULL,
+                        lines_removed INTEGER NOT NULL,
+                        sections_changed INTEGER NOT NULL,
+                        analysis TEXT,
+                        created_date TEXT NOT NULL,
+                        PRIMARY KEY (from_version, to_version)
+                    );
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_version_diffs_to ON version_diffs (to_version);")
+                # Filled from rule_versions and version_diffs, so it comes after both
+                _setup_daily_summary(conn)
+                # The rules to track: discovered from rulebook index pages (src/discovery.py)
+                # or imported from data/tracked_rules.json. shard_key splits them into shards.
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS tracked_rules (
+                        id TEXT PRIMARY KEY,
+                        name TEXT NOT NULL,
+                        url TEXT NOT NULL,
+                        rulebook TEXT,
+                        selectors TEXT,
+                        enabled INTEGER NOT NULL DEFAULT 1,
+                        shard_key INTEGER NOT NULL,
+                        source TEXT NOT NULL,
+                        discovered_date TEXT NOT NULL,
+                        last_seen TEXT NOT NULL
+                    );
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_tracked_rules_url ON tracked_rules (url);")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_tracked_rules_rulebook ON tracked_rules (rulebook, id);")
+            except Exception:
+                conn.execute("ROLLBACK;")
+                raise
+            conn.execute("COMMIT;")
+            _setup_paths.add(DB_PATH)
+    except sqlite3.Error as e:
+        print(f"Error setting up database table: {e}")
+
+def _add_column_if_missing(conn, table, column, declaration):
+    """ALTER TABLE ... ADD COLUMN, unless the column is already there. Returns True if added."""
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table});")]
+    if column in columns:
+        return False
+    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration};")
+    return True
+
+def migrate_database(conn):
+    """Bring an existing database up to the current schema. Safe to run repeatedly."""
+    # Normalized content hash per version, so change detection is a hash compare
+    _add_column_if_missing(conn, "rule_versions", "content_hash", "TEXT")
+    rows = conn.execute("SELECT id, rule_text FROM rule_versions WHERE content_hash IS NULL;").fetchall()
+    for version_id, text in rows:
+        conn.execute("UPDATE rule_versions SET content_hash = ? WHERE id = ?", (content_hash(text or ""), version_id))
+    if rows:
+        print(f"Backfilled content hashes for {len(rows)} stored versions.")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_rule_versions_rule_id ON rule_versions (rule_id, id);")
+
+    # Delta/keyframe storage. Rows with storage NULL or 'text' keep their text in rule_text.
+    _add_column_if_missing(conn, "rule_versions", "storage", "TEXT")
+    _add_column_if_missing(conn, "rule_versions", "payload", "BLOB")
+    _add_column_if_missing(conn, "rule_versions", "chain_depth", "INTEGER")
+    if _add_column_if_missing(conn, "rule_versions", "text_length", "INTEGER"):
+        conn.execute("UPDATE rule_versions SET text_length = length(rule_text);")
+
+    # Content-addressed text store ('blob' storage mode). Created before any
+    # backfill below, since _iter_rule_texts reads blob_hash.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS text_blobs (
+            hash TEXT PRIMARY KEY,
+            storage TEXT NOT NULL,
+            payload BLOB NOT NULL,
+            base_hash TEXT,
+            chain_depth INTEGER NOT NULL,
+            text_length INTEGER NOT NULL
+        );
+    """)
+    _add_column_if_missing(conn, "rule_versions", "blob_hash", "TEXT")
+
+    # Per-version metadata written with the version, so history views never read text
+    added = _add_column_if_missing(conn, "rule_versions", "line_count", "INTEGER")
+    added = _add_column_if_missing(conn, "rule_versions", "word_count", "INTEGER") or added
+    if added:
+        rule_ids = [row[0] for row in conn.execute("SELECT DISTINCT rule_id FROM rule_versions;")]
+        for rule_id in rule_ids:
+            for version_id, text in list(_iter_rule_texts(conn, rule_id)):
+                line_count, word_count = text_stats(text)
+                conn.execute("UPDATE rule_versions SET text_length = ?, line_count = ?, word_count = ? WHERE id = ?",
+                             (len(text), line_count, word_count, version_id))
+
+    _setup_search_index(conn)
+    _setup_line_origins(conn)
+
+def _setup_daily_summary(conn):
+    """
+    Creates the per-rule, per-day summary that log_new_version keeps up to date,
+    and fills it from the existing versions and their stored diffs (pairs
+    written before version_diffs existed count as 0 changed lines).
+    """
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'rule_daily_summary';").fetchone():
+        return
+    conn.execute("""
+        CREATE TABLE rule_daily_summary (
+            rule_id TEXT NOT NULL,
+            day TEXT NOT NULL,
+            versions INTEGER NOT NULL,
+            changes INTEGER NOT NULL,
+            lines_added INTEGER NOT NULL,
+            lines_removed INTEGER NOT NULL,
+            sections_changed INTEGER NOT NULL,
+            text_length INTEGER,
+            last_version_id INTEGER NOT NULL,
+            PRIMARY KEY (rule_id, day)
+        );
+    """)
+    conn.execute("CREATE INDEX idx_rule_daily_summary_day ON rule_daily_summary (day);")
+    conn.execute("""
+        INSERT INTO rule_daily_summary
+        SELECT v.rule_id, substr(v.check_date, 1, 10), COUNT(*), COALESCE(SUM(d.sections_changed > 0), 0),
+               COALESCE(SUM(d.lines_added), 0), COALESCE(SUM(d.lines_removed), 0), COALESCE(SUM(d.sections_changed), 0),
+               NULL, MAX(v.id)
+        FROM rule_versions v
+        LEFT JOIN version_diffs d ON d.to_version = v.id AND d.from_version = (
+            SELECT MAX(p.id) FROM rule_versions p WHERE p.rule_id = v.rule_id AND p.id < v.id)
+        GROUP BY v.rule_id, substr(v.check_date, 1, 10);
+    """)
+    conn.execute("""UPDATE rule_daily_summary SET text_length =
+                    (SELECT text_length FROM rule_versions WHERE id = rule_daily_summary.last_version_id);""")
+
+def _update_daily_summary(conn, rule_id, check_date, version_id, text_length, stats=None):
+    """Adds one new version (and the stats of its diff, if it has a predecessor) to rule_daily_summary."""
+    stats = stats or {'lines_added': 0, 'lines_removed': 0, 'sections_changed': 0}
+    conn.execute(
+        """INSERT INTO rule_daily_summary
+           (rule_id, day, versions, changes, lines_added, lines_removed, sections_changed, text_length, last_version_id)
+           VALUES (?, ?, 1, ?, ?, ?, ?, ?, ?)
+           ON CONFLICT (rule_id, day) DO UPDATE SET
+               versions = versions + 1,
+               changes = changes + excluded.changes,
+               lines_added = lines_added + excluded.lines_added,
+               lines_removed = lines_removed + excluded.lines_removed,
+               sections_changed = sections_changed + excluded.sections_changed,
+               text_length = CASE WHEN excluded.last_version_id > last_version_id
+                                  THEN excluded.text_length ELSE text_length END,
+               last_version_id = MAX(last_version_id, excluded.last_version_id);""",
+        (rule_id, check_date[:10], 1 if stats['sections_changed'] else 0, stats['lines_added'], stats['lines_removed'],
+         stats['sections_changed'], text_length, version_id)
+    )
+
+def _setup_line_origins(conn):
+    """Creates the line provenance table (see src/provenance.py) and backfills it, oldest version first."""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'line_origins';").fetchone():
+        return
+    conn.execute("CREATE TABLE line_origins (version_id INTEGER PRIMARY KEY, runs TEXT NOT NULL);")
+    indexed = 0
+    rule_ids = [row[0] for row in conn.execute("SELECT DISTINCT rule_id FROM rule_versions;")]
+    for rule_id in rule_ids:
+        previous_id, previous_text = None, None
+        for version_id, text in list(_iter_rule_texts(conn, rule_id)):
+            _store_line_origins(conn, version_id, text, previous_id, previous_text)
+            previous_id, previous_text = version_id, text
+            indexed += 1
+    if indexed:
+        print(f"Computed line provenance for {indexed} stored versions.")
+
+def _setup_search_index(conn):
+    """
+    Creates the FTS5 index over every version (rowid = rule_versions.id) and
+    backfills it. The index is contentless: the text itself stays delta
+    encoded in rule_versions, and snippets are cut from the rebuilt text.
+    """
+    global _search_available
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'rule_versions_fts';").fetchone():
+        return
+    try:
+        conn.execute("CREATE VIRTUAL TABLE rule_versions_fts USING fts5(body, content='', tokenize='porter unicode61');")
+    except sqlite3.OperationalError as e:
+        print(f"Full-text search disabled: {e}")
+        _search_available = False
+        return
+    indexed = 0
+    rule_ids = [row[0] for row in conn.execute("SELECT DISTINCT rule_id FROM rule_versions;")]
+    for rule_id in rule_ids:
+        for version_id, text in list(_iter_rule_texts(conn, rule_id)):
+            conn.execute("INSERT INTO rule_versions_fts (rowid, body) VALUES (?, ?)", (version_id, text))
+            indexed += 1
+    if indexed:
+        print(f"Indexed {indexed} stored versions for full-text search.")
+
+def text_stats(text: str):
+    """(line_count, word_count) stored alongside every version."""
+    return len(text.splitlines()), len(text.split())
+
+def blob_key(text: str) -> str:
+    """Content address of a text: SHA-256 of the exact text (unlike content_hash, nothing is normalized)."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+# A blob followed by its delta bases, newest first. Rows come out one link at a
+# time, so a caller can stop reading as soon as it reaches a text it already has.
+_BLOB_CHAIN_SQL = """
+    WITH RECURSIVE chain(hash, storage, payload, base_hash) AS (
+        SELECT hash, storage, payload, base_hash FROM text_blobs WHERE hash = ?
+        UNION ALL
+        SELECT b.hash, b.storage, b.payload, b.base_hash
+        FROM text_blobs b JOIN chain c ON b.hash = c.base_hash WHERE c.storage = 'delta'
+    )
+    SELECT hash, storage, payload FROM chain;
+"""
+
+def _load_blob(conn, key, known=None):
+    """Rebuild a blob's text from its delta chain. `known` maps blob hashes to texts already decoded."""
+    chain = []
+    text = ""
+    for blob_hash, storage, payload in conn.execute(_BLOB_CHAIN_SQL, (key,)):
+        if known and blob_hash in known:
+            text = known[blob_hash]
+            break
+        chain.append((storage, payload))
+    for storage, payload in reversed(chain):
+        text = apply_delta(text, payload) if storage == DELTA else decode_full(payload)
+    return text
+
+def _store_blob(conn, text, base_key=None):
+    """
+    Stores text under its content address unless that blob already exists, and
+    returns the address. A new blob is a delta against base_key (normally the
+    rule's previous text) until the chain reaches KEYFRAME_INTERVAL.
+    """
+    key = blob_key(text)
+    if conn.execute("SELECT 1 FROM text_blobs WHERE hash = ?;", (key,)).fetchone():
+        return key
+    base = conn.execute("SELECT chain_depth FROM text_blobs WHERE hash = ?;", (base_key,)).fetchone() if base_key else None
+    if base and base[0] + 1 < KEYFRAME_INTERVAL:
+        storage, payload, depth = DELTA, encode_delta(_load_blob(conn, base_key), text), base[0] + 1
+    else:
+        storage, payload, depth, base_key = FULL, encode_full(text), 0, None
+    conn.execute(
+        "INSERT INTO text_blobs (hash, storage, payload, base_hash, chain_depth, text_length) VALUES (?, ?, ?, ?, ?, ?)",
+        (key, storage, payload, base_key, depth, len(text))
+    )
+    return key
+
+def _prune_blobs(conn):
+    """Deletes blobs no version references (directly or as a delta base). Returns how many."""
+    removed = 0
+    while True:
+        cursor = conn.execute(
+            """DELETE FROM text_blobs
+               WHERE hash NOT IN (SELECT blob_hash FROM rule_versions WHERE blob_hash IS NOT NULL)
+                 AND hash NOT IN (SELECT base_hash FROM text_blobs WHERE base_hash IS NOT NULL);"""
+        )
+        if cursor.rowcount <= 0:
+            return removed
+        removed += cursor.rowcount
+
+def _load_text(conn, version_id):
+    """Rebuild the text of one version, walking back at most to its keyframe."""
+    row = conn.execute(
+        "SELECT rule_id, storage, chain_depth, rule_text, blob_hash FROM rule_versions WHERE id = ?;", (version_id,)
+    ).fetchone()
+    if not row:
+        return ""
+    rule_id, storage, depth, rule_text, blob_hash = row
+    if storage == BLOB:
+        return _load_blob(conn, blob_hash)
+    if storage not in (FULL, DELTA):
+        return rule_text
+
+    chain = conn.execute(
+        "SELECT storage, payload, rule_text, blob_hash FROM rule_versions WHERE rule_id = ? AND id <= ? ORDER BY id DESC LIMIT ?;",
+        (rule_id, version_id, (depth or 0) + 1)
+    ).fetchall()
+    text = ""
+    for storage, payload, rule_text, blob_hash in reversed(chain):
+        if storage == DELTA:
+            text = apply_delta(text, payload)
+        elif storage == FULL:
+            text = decode_full(payload)
+        elif storage == BLOB:
+            text = _load_blob(conn, blob_hash)
+        else:
+            text = rule_text
+    return text
+
+def _iter_rule_texts(conn, rule_id):
+    """Yield (version_id, text) for every version of a rule, oldest first, decoding sequentially."""
+    rows = conn.execute(
+        "SELECT id, storage, payload, rule_text, blob_hash FROM rule_versions WHERE rule_id = ? ORDER BY id;", (rule_id,)
+    ).fetchall()
+    text = ""
+    known = {}
+    for version_id, storage, payload, rule_text, blob_hash in rows:
+        if storage == DELTA:
+            text = apply_delta(text, payload)
+        elif storage == FULL:
+            text = decode_full(payload)
+        elif storage == BLOB:
+            # A new blob is usually a delta against the previous version's blob
+            text = _load_blob(conn, blob_hash, known)
+            known = {blob_hash: text}
+        else:
+            text = rule_text
+        yield version_id, text
+
+def _encode_version(conn, rule_id, new_text, mode, before_id=None):
+    """
+    Returns (storage, payload, chain_depth, rule_text, blob_hash) for a row of a rule,
+    storing the text blob first in 'blob' mode. The delta base is the rule's latest
+    row, or its latest row before `before_id`.
+    """
+    if mode not in ('delta', BLOB):
+        return 'text', None, 0, new_text, None
+
+    if before_id is None:
+        previous = conn.execute(
+            "SELECT id, chain_depth, blob_hash FROM rule_versions WHERE rule_id = ? ORDER BY id DESC LIMIT 1;", (rule_id,)
+        ).fetchone()
+    else:
+        previous = conn.execute(
+            "SELECT id, chain_depth, blob_hash FROM rule_versions WHERE rule_id = ? AND id < ? ORDER BY id DESC LIMIT 1;",
+            (rule_id, before_id)
+        ).fetchone()
+    if mode == BLOB:
+        # Blob rows start a fresh row chain: a later 'delta' row can use them as its keyframe
+        return BLOB, None, 0, "", _store_blob(conn, new_text, previous[2] if previous else None)
+    if previous:
+        depth = (previous[1] or 0) + 1
+        if depth < KEYFRAME_INTERVAL:
+            base_text = _load_text(conn, previous[0])
+            return DELTA, encode_delta(base_text, new_text), depth, "", None
+    return FULL, encode_full(new_text), 0, "", None
+
+def get_latest_hash(rule_id: str):
+    """Retrieve the content hash of the latest saved version for a rule ('' if none)."""
     conn = create_connection()
+    latest_hash = ""
     if conn:
         try:
-            # UPDATED: Added 'rule_id' column to track different rules separately
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS rule_versions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    rule_id TEXT NOT NULL,
-                    rule_text TEXT NOT NULL,
-                    change_summary TEXT,
-                    check_date TEXT NOT NULL
-                );
-            """)
-            conn.commit()
-            conn.close()
-        except sqlite3.Error as e:
-            print(f"Error setting up database table: {e}")
+            cursor = conn.cursor()
+            cursor.execute("SELECT content_hash FROM rule_versions WHERE rule_id = ? ORDER BY id DESC LIMIT 1;", (rule_id,))
+            result = cursor.fetchone()
+            if result:
+                latest_hash = result[0] or ""
+        except sqlite3.Error as e:
+            print(f"Error retrieving latest hash: {e}")
+    return latest_hash
+
+def has_baseline(rule_id: str) -> bool:
+    """True if at least one version of the rule has been stored."""
+    conn = create_connection()
+    found = False
+    if conn:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1 FROM rule_versions WHERE rule_id = ? LIMIT 1;", (rule_id,))
+            found = cursor.fetchone() is not None
+        except sqlite3.Error as e:
+            print(f"Error checking for baseline: {e}")
+    return found
 
 def get_latest_version(rule_id: str):
     """Retrieve the text of the latest saved version for a SPECIFIC rule."""
@@ -44,34 +583,598 @@ def get_latest_version(rule_id: str):
         try:
             cursor = conn.cursor()
             # UPDATED: Filter by rule_id
-            cursor.execute("SELECT rule_text FROM rule_versions WHERE rule_id = ? ORDER BY id DESC LIMIT 1;", (rule_id,))
+            cursor.execute("SELECT id FROM rule_versions WHERE rule_id = ? ORDER BY id DESC LIMIT 1;", (rule_id,))
             result = cursor.fetchone()
             if result:
-                latest_text = result[0]
-            conn.close()
+                latest_text = _load_text(conn, result[0])
         except sqlite3.Error as e:
             print(f"Error retrieving latest version: {e}")
     return latest_text
 
-def log_new_version(rule_id: str, new_text: str, summary: str = "Initial or Minor Change"):
-    """Insert a new rule version into the database for a specific rule."""
+def get_latest_version_id(rule_id: str):
+    """Id of the newest stored version of a rule, or None. Cheap: one index probe."""
+    conn = create_connection()
+    latest_id = None
+    if conn:
+        try:
+            result = conn.execute("SELECT MAX(id) FROM rule_versions WHERE rule_id = ?;", (rule_id,)).fetchone()
+            latest_id = result[0] if result else None
+        except sqlite3.Error as e:
+            print(f"Error retrieving latest version id: {e}")
+    return latest_id
+
+def get_latest_check_dates():
+    """rule_id -> check_date of its newest stored version, for every rule with versions."""
+    conn = create_connection()
+    dates = {}
+    if conn:
+        try:
+            dates = dict(conn.execute("SELECT rule_id, MAX(check_date) FROM rule_versions GROUP BY rule_id;").fetchall())
+        except sqlite3.Error as e:
+            print(f"Error retrieving latest check dates: {e}")
+    return dates
+
+def get_version_history(rule_id: str):
+    """
+    Metadata of every version of a rule, newest first, as a list of dicts with
+    id, check_date, text_length, line_count, word_count, change_summary and
+    blob_hash (equal blob hashes mean identical text; None outside 'blob' mode).
+    Never touches the stored text.
+    """
     conn = create_connection()
+    history = []
     if conn:
         try:
-            timestamp = datetime.datetime.now().isoformat()
+            cursor = conn.execute(
+                """SELECT id, check_date, text_length, line_count, word_count, change_summary, blob_hash
+                   FROM rule_versions WHERE rule_id = ? ORDER BY check_date DESC, id DESC;""", (rule_id,)
+            )
+            columns = [c[0] for c in cursor.description]
+            history = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Error retrieving version history: {e}")
+    return history
+
+def get_daily_summary(since: str = None, rule_ids=None):
+    """
+    Rows of rule_daily_summary from day `since` (YYYY-MM-DD) on, oldest first,
+    as dicts with rule_id, day, versions, changes, lines_added, lines_removed,
+    sections_changed, text_length (at the end of the day) and last_version_id.
+    """
+    conn = create_connection()
+    rows = []
+    if conn:
+        try:
+            query = "SELECT * FROM rule_daily_summary WHERE day >= ?"
+            params = [since or ""]
+            if rule_ids:
+                query += f" AND rule_id IN ({','.join('?' * len(rule_ids))})"
+                params += list(rule_ids)
+            cursor = conn.execute(query + " ORDER BY day, rule_id;", params)
+            columns = [c[0] for c in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Error retrieving daily summary: {e}")
+    return rows
+
+def get_portfolio_summary(since: str = None):
+    """
+    Per-rule totals from rule_daily_summary since day `since`: dicts with
+    rule_id, versions, changes, lines_added, lines_removed, sections_changed,
+    first_day and last_day, most changed lines first.
+    """
+    conn = create_connection()
+    rows = []
+    if conn:
+        try:
+            cursor = conn.execute(
+                """SELECT rule_id, SUM(versions) AS versions, SUM(changes) AS changes,
+                          SUM(lines_added) AS lines_added, SUM(lines_removed) AS lines_removed,
+                          SUM(sections_changed) AS sections_changed, MIN(day) AS first_day, MAX(day) AS last_day
+                   FROM rule_daily_summary WHERE day >= ?
+                   GROUP BY rule_id ORDER BY SUM(lines_added) + SUM(lines_removed) DESC, rule_id;""", (since or "",)
+            )
+            columns = [c[0] for c in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Error retrieving portfolio summary: {e}")
+    return rows
+
+def get_version_text(version_id: int):
+    """Retrieve the full text of one stored version by its id ('' if unknown)."""
+    conn = create_connection()
+    text = ""
+    if conn:
+        try:
+            text = _load_text(conn, version_id)
+        except sqlite3.Error as e:
+            print(f"Error retrieving version {version_id}: {e}")
+    return text
+
+def log_new_version(rule_id: str, new_text: str, summary: str = "Initial or Minor Change", check_date: str = None,
+                    section_changes=None, analysis=None, fetch_state=None):
+    """
+    Insert a new rule version into the database for a specific rule.
+    check_date defaults to now; pass an ISO timestamp to backdate (demo data).
+
+    The diff against the rule's previous version is stored in version_diffs
+    in the same transaction. Pass section_changes (from compare_sections) if
+    they are already computed, and the NLP analysis if it has already run.
+    fetch_state is the downloader page (url, etag, last_modified, body_hash)
+    the text came from: its validators are saved in the same transaction, so
+    a page is never skipped as unmodified before its version is stored.
+    Returns the new version's id, or None on error.
+    """
+    try:
+        timestamp = check_date or datetime.datetime.now().isoformat()
+        with _write_transaction() as conn:
+            previous_id = conn.execute("SELECT MAX(id) FROM rule_versions WHERE rule_id = ?;", (rule_id,)).fetchone()[0]
+            storage, payload, depth, rule_text, blob_hash = _encode_version(conn, rule_id, new_text, STORAGE_MODE)
             # UPDATED: Insert rule_id
+            line_count, word_count = text_stats(new_text)
+            cursor = conn.execute(
+                """INSERT INTO rule_versions
+                   (rule_id, rule_text, change_summary, check_date, content_hash, storage, payload, chain_depth,
+                    text_length, line_count, word_count, blob_hash)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (rule_id, rule_text, summary, timestamp, content_hash(new_text), storage, payload, depth,
+                 len(new_text), line_count, word_count, blob_hash)
+            )
+            version_id = cursor.lastrowid
+            if _search_available:
+                conn.execute("INSERT INTO rule_versions_fts (rowid, body) VALUES (?, ?)", (version_id, new_text))
+            previous_text = None
+            if previous_id is not None:
+                if blob_hash is not None and blob_hash == conn.execute(
+                        "SELECT blob_hash FROM rule_versions WHERE id = ?;", (previous_id,)).fetchone()[0]:
+                    previous_text = new_text  # same blob, same text: nothing to load
+                    if section_changes is None:
+                        section_changes = []
+                else:
+                    previous_text = _load_text(conn, previous_id)
+                if section_changes is None:
+                    _, section_changes = compare_sections(previous_text, new_text)
+                stats = _insert_version_diff(conn, previous_id, version_id, section_changes, analysis)
+            else:
+                stats = None
+            _store_line_origins(conn, version_id, new_text, previous_id, previous_text)
+            _update_daily_summary(conn, rule_id, timestamp, version_id, len(new_text), stats)
+            if fetch_state:
+                _save_fetch_state(conn, fetch_state)
+        print(f"[{rule_id}] New version logged on {timestamp}.")
+        return version_id
+    except sqlite3.Error as e:
+        print(f"Error logging new version: {e}")
+        return None
+
+def _line_origins(conn, version_id):
+    row = conn.execute("SELECT runs FROM line_origins WHERE version_id = ?;", (version_id,)).fetchone()
+    return decode_runs(row[0]) if row else None
+
+def _store_line_origins(conn, version_id, text, previous_id=None, previous_text=None):
+    """Carries the predecessor's line origins forward to a new version (one diff, no history walk)."""
+    lines = text.splitlines()
+    if previous_id is None:
+        origins = [version_id] * len(lines)
+    elif previous_text == text:
+        origins = _line_origins(conn, previous_id) or [previous_id] * len(lines)
+    else:
+        old_lines = previous_text.splitlines()
+        old_origins = _line_origins(conn, previous_id)
+        if old_origins is None or len(old_origins) != len(old_lines):
+            old_origins = [previous_id] * len(old_lines)  # predecessor not indexed: its lines date from it at the latest
+        origins = carry_origins(old_origins, old_lines, lines, version_id)
+    conn.execute("INSERT OR REPLACE INTO line_origins (version_id, runs) VALUES (?, ?)", (version_id, encode_runs(origins)))
+
+def get_line_origins(version_id: int):
+    """For each line of a version (text.splitlines()), the id of the version that introduced it. [] if unknown."""
+    conn = create_connection()
+    origins = []
+    if conn:
+        try:
+            origins = _line_origins(conn, version_id) or []
+        except sqlite3.Error as e:
+            print(f"Error retrieving line origins of version {version_id}: {e}")
+    return origins
+
+def get_blame(version_id: int):
+    """
+    The lines of a version with their provenance: dicts with line_no (1-based),
+    text, version_id (the version that introduced the line) and check_date.
+    """
+    conn = create_connection()
+    blame = []
+    if conn:
+        try:
+            origins = _line_origins(conn, version_id) or []
+            lines = _load_text(conn, version_id).splitlines()
+            dates = {}
+            for origin in set(origins):
+                row = conn.execute("SELECT check_date FROM rule_versions WHERE id = ?;", (origin,)).fetchone()
+                dates[origin] = row[0] if row else None
+            blame = [{'line_no': n + 1, 'text': line, 'version_id': origin, 'check_date': dates.get(origin)}
+                     for n, (line, origin) in enumerate(zip(lines, origins))]
+        except sqlite3.Error as e:
+            print(f"Error retrieving blame of version {version_id}: {e}")
+    return blame
+
+def _analysis_json(analysis):
+    # raw_changes is left out: it can be rebuilt from the stored opcodes (comparator.opcode_lines)
+    return json.dumps({k: v for k, v in analysis.items() if k != 'raw_changes'}) if analysis else None
+
+def _insert_version_diff(conn, from_version, to_version, section_changes, analysis):
+    stats = diff_stats(section_changes)
+    conn.execute(
+        """INSERT OR REPLACE INTO version_diffs
+           (from_version, to_version, section_changes, lines_added, lines_removed, sections_changed, analysis, created_date)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+        (from_version, to_version, json.dumps(section_changes), stats['lines_added'], stats['lines_removed'],
+         stats['sections_changed'], _analysis_json(analysis), datetime.datetime.now().isoformat())
+    )
+    return stats
+
+def store_version_diff(from_version: int, to_version: int, section_changes, analysis=None):
+    """Store the diff of any version pair (e.g. one the dashboard had to compute)."""
+    try:
+        with _write_transaction() as conn:
+            _insert_version_diff(conn, from_version, to_version, section_changes, analysis)
+        return True
+    except sqlite3.Error as e:
+        print(f"Error storing diff {from_version} -> {to_version}: {e}")
+    return False
+
+def save_diff_analysis(version_id: int, analysis):
+    """Attach the NLP analysis to the stored diff between a version and its predecessor."""
+    try:
+        with _write_transaction() as conn:
             conn.execute(
-                "INSERT INTO rule_versions (rule_id, rule_text, change_summary, check_date) VALUES (?, ?, ?, ?)",
-                (rule_id, new_text, summary, timestamp)
+                """UPDATE version_diffs SET analysis = ?
+                   WHERE to_version = ? AND from_version = (
+                       SELECT MAX(p.id) FROM rule_versions p JOIN rule_versions v ON v.rule_id = p.rule_id
+                       WHERE v.id = ? AND p.id < v.id);""",
+                (_analysis_json(analysis), version_id, version_id)
             )
-            conn.commit()
-            conn.close()
-            print(f"[{rule_id}] New version logged on {timestamp}.")
-            return True
+        return True
+    except sqlite3.Error as e:
+        print(f"Error saving analysis for version {version_id}: {e}")
+    return False
+
+def get_version_diff(from_version: int, to_version: int):
+    """
+    The stored diff of a version pair, or None if it was never computed: a
+    dict with section_changes (each with its opcodes), lines_added,
+    lines_removed, sections_changed, analysis (None if NLP hasn't run) and
+    created_date.
+    """
+    conn = create_connection()
+    diff = None
+    if conn:
+        try:
+            cursor = conn.execute(
+                """SELECT section_changes, lines_added, lines_removed, sections_changed, analysis, created_date
+                   FROM version_diffs WHERE from_version = ? AND to_version = ?;""", (from_version, to_version)
+            )
+            row = cursor.fetchone()
+            if row:
+                diff = dict(zip([c[0] for c in cursor.description], row))
+                diff['section_changes'] = json.loads(diff['section_changes'])
+                diff['analysis'] = json.loads(diff['analysis']) if diff['analysis'] else None
         except sqlite3.Error as e:
-            print(f"Error logging new version: {e}")
-            return False
+            print(f"Error retrieving diff {from_version} -> {to_version}: {e}")
+    return diff
+
+def delete_rule_history(rule_id: str, url: str = None):
+    """
+    Remove every stored version of a rule (used by the dashboard's demo reset).
+    Its text blobs are kept, since a re-baseline usually stores the same text
+    again; --migrate-storage drops the ones left unreferenced. The fetch state
+    of its page (url, or its tracked_rules url) is cleared too, so the next
+    check fetches it in full instead of skipping it as unmodified.
+    """
+    try:
+        with _write_transaction() as conn:
+            if _search_available:
+                # A contentless FTS5 row can only be removed by passing its original text back
+                for version_id, text in list(_iter_rule_texts(conn, rule_id)):
+                    conn.execute("INSERT INTO rule_versions_fts (rule_versions_fts, rowid, body) VALUES ('delete', ?, ?)",
+                                 (version_id, text))
+            version_ids = "SELECT id FROM rule_versions WHERE rule_id = ?"
+            conn.execute(f"DELETE FROM version_diffs WHERE from_version IN ({version_ids}) OR to_version IN ({version_ids});",
+                         (rule_id, rule_id))
+            conn.execute(f"DELETE FROM line_origins WHERE version_id IN ({version_ids});", (rule_id,))
+            conn.execute("DELETE FROM rule_daily_summary WHERE rule_id = ?", (rule_id,))
+            conn.execute("DELETE FROM rule_versions WHERE rule_id = ?", (rule_id,))
+            conn.execute("DELETE FROM fetch_state WHERE url = ? OR url IN (SELECT url FROM tracked_rules WHERE id = ?);",
+                         (url, rule_id))
+        return True
+    except sqlite3.Error as e:
+        print(f"Error deleting history for {rule_id}: {e}")
     return False
 
-# Run setup immediately on import to ensure table exists
-setup_database()
\ No newline at end of file
+def migrate_storage(mode: str = 'delta'):
+    """
+    Re-encode every stored version in the given storage mode ('blob', 'delta' or
+    'text'), rule by rule, drop text blobs nothing references any more, then
+    VACUUM so the file actually shrinks. Used to convert databases created
+    under an older storage mode.
+    """
+    try:
+        conn = create_connection()
+        rule_ids = [row[0] for row in conn.execute("SELECT DISTINCT rule_id FROM rule_versions;")]
+        for rule_id in rule_ids:
+            with _write_transaction() as conn:
+                texts = list(_iter_rule_texts(conn, rule_id))
+                # Rewrite oldest first so each delta is encoded against an already-rewritten base
+                conn.execute(
+                    "UPDATE rule_versions SET storage = NULL, payload = NULL, chain_depth = NULL, blob_hash = NULL WHERE rule_id = ?",
+                    (rule_id,)
+                )
+                for version_id, text in texts:
+                    conn.execute("UPDATE rule_versions SET rule_text = ? WHERE id = ?", (text, version_id))
+                for version_id, text in texts:
+                    storage, payload, depth, rule_text, blob_hash = _encode_version(conn, rule_id, text, mode, before_id=version_id)
+                    conn.execute(
+                        """UPDATE rule_versions SET storage = ?, payload = ?, chain_depth = ?, rule_text = ?, text_length = ?,
+                           blob_hash = ? WHERE id = ?""",
+                        (storage, payload, depth, rule_text, len(text), blob_hash, version_id)
+                    )
+            print(f"[{rule_id}] Re-encoded {len(texts)} versions as '{mode}'.")
+        with _write_transaction() as conn:
+            pruned = _prune_blobs(conn)
+        if pruned:
+            print(f"Removed {pruned} unreferenced text blobs.")
+        with _write_lock:
+            _get_writer().execute("VACUUM;")
+        return True
+    except sqlite3.Error as e:
+        print(f"Error migrating storage: {e}")
+        return False
+
+_QUERY_WORD_RE = re.compile(r'\w+')
+_QUERY_OPERATORS = {'AND', 'OR', 'NOT', 'NEAR'}
+
+def _query_terms(query):
+    return [t.lower() for t in _QUERY_WORD_RE.findall(query) if t not in _QUERY_OPERATORS]
+
+def _snippet(text, terms):
+    """
+    About SEARCH_SNIPPET_CHARS of text around the first query term, as a list
+    of (matched, text) segments. Terms are matched by prefix, a rough stand-in
+    for the porter stemming done by the index ('records' finds 'recordkeeping').
+    """
+    stems = [t[:max(4, len(t) - 3)] for t in terms]
+    pattern = re.compile(r'\b(?:' + '|'.join(re.escape(s) for s in stems) + r')\w*', re.IGNORECASE) if stems else None
+    first = pattern.search(text) if pattern else None
+    start = max(0, first.start() - SEARCH_SNIPPET_CHARS // 3) if first else 0
+    window = text[start:start + SEARCH_SNIPPET_CHARS]
+    segments = [(False, "…")] if start else []
+    pos = 0
+    for match in (pattern.finditer(window) if pattern else []):
+        if match.start() > pos:
+            segments.append((False, window[pos:match.start()]))
+        segments.append((True, match.group()))
+        pos = match.end()
+    segments.append((False, window[pos:]))
+    if start + SEARCH_SNIPPET_CHARS < len(text):
+        segments.append((False, "…"))
+    return segments
+
+def _match_rows(conn, match, limit, per_rule):
+    """
+    (rule_id, version_id, check_date, score) rows for an FTS5 MATCH expression.
+    Up to SEARCH_RANK_LIMIT hits are ranked by bm25. Beyond that ranking every
+    hit costs more than it is worth (most hits are near-identical versions of
+    the same rule), so the newest versions are streamed instead.
+    """
+    total = conn.execute("SELECT COUNT(*) FROM rule_versions_fts WHERE rule_versions_fts MATCH ?;", (match,)).fetchone()[0]
+    if total <= SEARCH_RANK_LIMIT:
+        score, order = "-f.rank", "f.rank"
+    else:
+        score, order = "NULL", "f.rowid DESC"
+    cursor = conn.execute(
+        f"""SELECT v.rule_id, v.id, v.check_date, {score}
+            FROM rule_versions_fts f JOIN rule_versions v ON v.id = f.rowid
+            WHERE rule_versions_fts MATCH ? ORDER BY {order};""", (match,)
+    )
+    rows, seen = [], set()
+    for row in cursor:
+        if per_rule:
+            if row[0] in seen:
+                continue
+            seen.add(row[0])
+        rows.append(row)
+        if len(rows) >= limit:
+            break
+    return rows
+
+def search_versions(query: str, limit: int = 20, per_rule: bool = False):
+    """
+    Full-text search over every archived version, best match first.
+    Returns dicts with rule_id, version_id, check_date, score (bm25, higher
+    is better; None when there were too many hits to rank) and snippet, a
+    list of (matched, text) segments. With per_rule=True each rule appears
+    once, with its best-matching version.
+
+    The query uses FTS5 syntax ("exact phrase", OR, NOT, prefix*); anything
+    that doesn't parse is searched as plain words.
+    """
+    conn = create_connection()
+    if not conn or not _search_available or not query.strip():
+        return []
+    try:
+        try:
+            rows = _match_rows(conn, query, limit, per_rule)
+        except sqlite3.OperationalError:
+            # Not valid FTS5 syntax (stray quotes, punctuation): search the words instead
+            words = _QUERY_WORD_RE.findall(query)
+            if not words:
+                return []
+            rows = _match_rows(conn, " ".join(f'"{w}"' for w in words), limit, per_rule)
+        terms = _query_terms(query)
+        return [
+            {'rule_id': rule_id, 'version_id': version_id, 'check_date': check_date,
+             'score': score, 'snippet': _snippet(_load_text(conn, version_id), terms)}
+            for rule_id, version_id, check_date, score in rows
+        ]
+    except sqlite3.Error as e:
+        print(f"Error searching versions: {e}")
+    return []
+
+def rule_shard_key(rule_id: str) -> int:
+    """Stable 32-bit hash of a rule id; a rule belongs to shard shard_key % shards."""
+    return int(hashlib.sha256(rule_id.encode('utf-8')).hexdigest()[:8], 16)
+
+def upsert_tracked_rules(rules, source: str = 'discovered'):
+    """
+    Adds rules ({'id', 'name', 'url', optional 'rulebook' and 'selectors'}) to
+    tracked_rules, or refreshes their url and last_seen. Names and selectors
+    already stored (e.g. hand-edited ones) are kept. Returns how many were new.
+    """
+    rules = list(rules)
+    if not rules:
+        return 0
+    try:
+        now = datetime.datetime.now().isoformat()
+        with _write_transaction() as conn:
+            before = conn.execute("SELECT COUNT(*) FROM tracked_rules;").fetchone()[0]
+            conn.executemany(
+                """INSERT INTO tracked_rules
+                   (id, name, url, rulebook, selectors, shard_key, source, discovered_date, last_seen)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (id) DO UPDATE SET url = excluded.url, last_seen = excluded.last_seen,
+                       rulebook = COALESCE(rulebook, excluded.rulebook),
+                       selectors = COALESCE(selectors, excluded.selectors);""",
+                [(rule['id'], rule['name'], rule['url'], rule.get('rulebook'),
+                  json.dumps(rule['selectors']) if rule.get('selectors') else None,
+                  rule_shard_key(rule['id']), source, now, now) for rule in rules]
+            )
+            return conn.execute("SELECT COUNT(*) FROM tracked_rules;").fetchone()[0] - before
+    except sqlite3.Error as e:
+        print(f"Error saving tracked rules: {e}")
+    return 0
+
+def count_tracked_rules(shard: int = 0, shards: int = 1) -> int:
+    """Enabled rules in tracked_rules (in the given shard)."""
+    conn = create_connection()
+    count = 0
+    if conn:
+        try:
+            count = conn.execute("SELECT COUNT(*) FROM tracked_rules WHERE enabled = 1 AND shard_key % ? = ?;",
+                                 (shards, shard)).fetchone()[0]
+        except sqlite3.Error as e:
+            print(f"Error counting tracked rules: {e}")
+    return count
+
+def iter_tracked_rules(shard: int = 0, shards: int = 1, batch_size: int = 500):
+    """
+    Yields the enabled rules of one shard as rule dicts (id, name, url,
+    rulebook, selectors), in id order, reading batch_size rows at a time so
+    even a whole rulebook is never held in memory at once.
+    """
+    conn = create_connection()
+    if not conn:
+        return
+    last_id = ""
+    while True:
+        try:
+            rows = conn.execute(
+                """SELECT id, name, url, rulebook, selectors FROM tracked_rules
+                   WHERE enabled = 1 AND shard_key % ? = ? AND id > ? ORDER BY id LIMIT ?;""",
+                (shards, shard, last_id, batch_size)
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"Error reading tracked rules: {e}")
+            return
+        for rule_id, name, url, rulebook, selectors in rows:
+            rule = {'id': rule_id, 'name': name, 'url': url, 'rulebook': rulebook}
+            if selectors:
+                rule['selectors'] = json.loads(selectors)
+            yield rule
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1][0]
+
+def get_fetch_state(url: str):
+    """Return the stored {'etag', 'last_modified', 'body_hash'} for a URL, or None."""
+    conn = create_connection()
+    state = None
+    if conn:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT etag, last_modified, body_hash FROM fetch_state WHERE url = ?;", (url,))
+            result = cursor.fetchone()
+            if result:
+                state = {'etag': result[0], 'last_modified': result[1], 'body_hash': result[2]}
+        except sqlite3.Error as e:
+            print(f"Error retrieving fetch state: {e}")
+    return state
+
+def _save_fetch_state(conn, state):
+    conn.execute(
+        "INSERT OR REPLACE INTO fetch_state (url, etag, last_modified, body_hash, fetch_date) VALUES (?, ?, ?, ?, ?)",
+        (state['url'], state['etag'], state['last_modified'], state['body_hash'], datetime.datetime.now().isoformat())
+    )
+
+def save_fetch_state(url: str, etag, last_modified, body_hash: str):
+    """
+    Remember the validators and body hash of the latest successful fetch of a
+    URL. Only call it once the page has been fully processed (see log_new_version).
+    """
+    try:
+        with _write_transaction() as conn:
+            _save_fetch_state(conn, {'url': url, 'etag': etag, 'last_modified': last_modified, 'body_hash': body_hash})
+        return True
+    except sqlite3.Error as e:
+        print(f"Error saving fetch state: {e}")
+    return False
+
+def get_cached_entities(para_hashes):
+    """Return {para_hash: entities} for the hashes found in the cache, marking them as used."""
+    found = {}
+    if not para_hashes:
+        return found
+    conn = create_connection()
+    if conn:
+        try:
+            # Stay well below SQLite's bound-parameter limit
+            for i in range(0, len(para_hashes), 500):
+                chunk = para_hashes[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                for para_hash, entities in conn.execute(
+                        f"SELECT para_hash, entities FROM entity_cache WHERE para_hash IN ({placeholders});", chunk):
+                    found[para_hash] = json.loads(entities)
+        except sqlite3.Error as e:
+            print(f"Error reading entity cache: {e}")
+    if found:
+        try:
+            now = time.time()
+            with _write_transaction() as conn:
+                conn.executemany("UPDATE entity_cache SET last_used = ? WHERE para_hash = ?",
+                                 [(now, h) for h in found])
+        except sqlite3.Error as e:
+            print(f"Error touching entity cache: {e}")
+    return found
+
+def store_cached_entities(entities_by_hash):
+    """Cache {para_hash: entities}. Evicts least recently used rows past the size bound; returns how many."""
+    if not entities_by_hash:
+        return 0
+    try:
+        now = time.time()
+        with _write_transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO entity_cache (para_hash, entities, last_used) VALUES (?, ?, ?)",
+                [(h, json.dumps(e), now) for h, e in entities_by_hash.items()]
+            )
+            overflow = conn.execute("SELECT COUNT(*) FROM entity_cache;").fetchone()[0] - ENTITY_CACHE_MAX_ENTRIES
+            if overflow > 0:
+                conn.execute(
+                    "DELETE FROM entity_cache WHERE para_hash IN "
+                    "(SELECT para_hash FROM entity_cache ORDER BY last_used LIMIT ?);", (overflow,)
+                )
+        return max(overflow, 0)
+    except sqlite3.Error as e:
+        print(f"Error writing entity cache: {e}")
+    return 0
+
+# End of database_manager.py
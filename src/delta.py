@@ -0,0 +1,53 @@
+# src/delta.py
+
+import json
+import zlib
+from typing import List
+from src.diff_engine import diff_opcodes
+
+# Payload kinds stored in rule_versions.storage
+FULL = 'full'     # zlib-compressed full text (a keyframe)
+DELTA = 'delta'   # zlib-compressed line delta against the previous version
+BLOB = 'blob'     # reference to a content-addressed text in text_blobs (see database_manager)
+
+def encode_full(text: str) -> bytes:
+    """Compress a full copy of the text (used for keyframes)."""
+    return zlib.compress(text.encode('utf-8'), 9)
+
+def encode_delta(base_text: str, new_text: str) -> bytes:
+    """
+    Encodes new_text as a list of line operations against base_text:
+    [i1, i2] copies base lines i1..i2, a list of strings inserts new lines.
+    Line endings are kept so decoding reproduces the text exactly.
+    """
+    base_lines = base_text.splitlines(keepends=True)
+    new_lines = new_text.splitlines(keepends=True)
+
+    ops = []
+    for tag, i1, i2, j1, j2 in diff_opcodes(base_lines, new_lines):
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif tag in ('insert', 'replace'):
+            ops.append(new_lines[j1:j2])
+        # 'delete' needs no op: the base lines are simply not copied
+
+    payload = json.dumps(ops, separators=(',', ':'))
+    return zlib.compress(payload.encode('utf-8'), 9)
+
+def decode_full(payload: bytes) -> str:
+    return zlib.decompress(payload).decode('utf-8')
+
+def apply_delta(base_text: str, payload: bytes) -> str:
+    """Rebuilds a version from the text it was delta-encoded against."""
+    base_lines = base_text.splitlines(keepends=True)
+    ops = json.loads(zlib.decompress(payload).decode('utf-8'))
+
+    lines: List[str] = []
+    for op in ops:
+        if op and isinstance(op[0], int):
+            lines.extend(base_lines[op[0]:op[1]])
+        else:
+            lines.extend(op)
+    return "".join(lines)
+
+# End of delta.py
@@ -0,0 +1,262 @@
+# src/diff_engine.py
+
+import re
+from bisect import bisect_left
+from typing import Hashable, List, Sequence, Tuple
+
+# Shared diff engine for the comparator, the HTML reporter, the dashboard
+# redline and delta storage.
+#
+# Patience diff: lines that occur exactly once on both sides are used as
+# anchors (longest increasing subsequence), and the gaps between anchors are
+# diffed recursively. Gaps with no unique lines fall back to Myers' O(ND)
+# algorithm, capped at MAX_EDIT_COST so pathological input degrades to a
+# coarse 'replace' instead of quadratic time. Unlike difflib there is no
+# autojunk heuristic, so repetitive legal boilerplate still lines up.
+
+# Largest edit distance Myers will search for inside one gap
+MAX_EDIT_COST = 2000
+
+Opcode = Tuple[str, int, int, int, int]
+
+def diff_opcodes(a: Sequence[Hashable], b: Sequence[Hashable]) -> List[Opcode]:
+    """
+    Diffs two sequences (usually lists of lines) and returns opcodes in the
+    same format as difflib.SequenceMatcher.get_opcodes():
+    (tag, i1, i2, j1, j2) with tag in 'equal', 'replace', 'delete', 'insert'.
+    """
+    # Work on small ints: hashing/comparing long lines once, not per probe
+    ids = {}
+    a_ids = [ids.setdefault(x, len(ids)) for x in a]
+    b_ids = [ids.setdefault(x, len(ids)) for x in b]
+    return _opcodes_from_matches(_match(a_ids, b_ids), len(a), len(b))
+
+def _match(a, b) -> List[Tuple[int, int]]:
+    """Returns the matched (i, j) index pairs, sorted."""
+    matches = []
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        alo, ahi, blo, bhi = stack.pop()
+
+        # Common prefix and suffix match trivially
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            matches.append((alo, blo))
+            alo += 1
+            blo += 1
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+            matches.append((ahi, bhi))
+        if alo == ahi or blo == bhi:
+            continue
+
+        anchors = _unique_anchors(a, alo, ahi, b, blo, bhi)
+        if not anchors:
+            matches.extend(_myers(a, alo, ahi, b, blo, bhi))
+            continue
+
+        # Diff the gaps before, between and after the anchors
+        prev_i, prev_j = alo, blo
+        for i, j in anchors:
+            matches.append((i, j))
+            stack.append((prev_i, i, prev_j, j))
+            prev_i, prev_j = i + 1, j + 1
+        stack.append((prev_i, ahi, prev_j, bhi))
+
+    matches.sort()
+    return matches
+
+def _unique_anchors(a, alo, ahi, b, blo, bhi) -> List[Tuple[int, int]]:
+    """Lines unique to both ranges, reduced to their longest increasing subsequence."""
+    counts = {}
+    for i in range(alo, ahi):
+        entry = counts.get(a[i])
+        counts[a[i]] = [i, -1, 1, 0] if entry is None else [entry[0], -1, entry[2] + 1, 0]
+    for j in range(blo, bhi):
+        entry = counts.get(b[j])
+        if entry is not None:
+            entry[1] = j
+            entry[3] += 1
+
+    pairs = [(entry[0], entry[1]) for entry in counts.values() if entry[2] == 1 and entry[3] == 1]
+    if not pairs:
+        return []
+    pairs.sort()
+
+    # Patience sorting: longest increasing subsequence of the j's
+    tails, tail_idx, back = [], [], [None] * len(pairs)
+    for n, (_, j) in enumerate(pairs):
+        pos = bisect_left(tails, j)
+        if pos == len(tails):
+            tails.append(j)
+            tail_idx.append(n)
+        else:
+            tails[pos] = j
+            tail_idx[pos] = n
+        back[n] = tail_idx[pos - 1] if pos else None
+
+    result = []
+    n = tail_idx[-1]
+    while n is not None:
+        result.append(pairs[n])
+        n = back[n]
+    result.reverse()
+    return result
+
+def _myers(a, alo, ahi, b, blo, bhi) -> List[Tuple[int, int]]:
+    """Myers' greedy O(ND) diff of a[alo:ahi] vs b[blo:bhi]; returns matched pairs."""
+    n, m = ahi - alo, bhi - blo
+    max_d = min(n + m, MAX_EDIT_COST)
+    offset = max_d + 1
+    v = [-1] * (2 * max_d + 3)
+    v[offset + 1] = 0
+    trace = []
+
+    found = False
+    for d in range(max_d + 1):
+        # Snapshot of the diagonals k = -d-1 .. d+1 as they were before step d
+        trace.append(v[offset - d - 1:offset + d + 2])
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                found = True
+                break
+        if found:
+            break
+
+    if not found:
+        # Too different to be worth searching: treat the whole gap as replaced
+        return []
+
+    matches = []
+    x, y = n, m
+    for d in range(len(trace) - 1, 0, -1):
+        snapshot = trace[d]
+        k = x - y
+        if k == -d or (k != d and snapshot[k - 1 + d + 1] < snapshot[k + 1 + d + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = snapshot[prev_k + d + 1]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+            matches.append((alo + x, blo + y))
+        x, y = prev_x, prev_y
+    while x > 0 and y > 0:
+        x -= 1
+        y -= 1
+        matches.append((alo + x, blo + y))
+    return matches
+
+def _opcodes_from_matches(matches, len_a, len_b) -> List[Opcode]:
+    opcodes = []
+    i = j = 0
+    idx = 0
+    while idx < len(matches):
+        mi, mj = matches[idx]
+        if i < mi or j < mj:
+            tag = 'replace' if (i < mi and j < mj) else ('delete' if i < mi else 'insert')
+            opcodes.append((tag, i, mi, j, mj))
+        # Extend the run of consecutive matches into one 'equal' block
+        size = 1
+        while idx + size < len(matches) and matches[idx + size] == (mi + size, mj + size):
+            size += 1
+        opcodes.append(('equal', mi, mi + size, mj, mj + size))
+        i, j = mi + size, mj + size
+        idx += size
+    if i < len_a or j < len_b:
+        tag = 'replace' if (i < len_a and j < len_b) else ('delete' if i < len_a else 'insert')
+        opcodes.append((tag, i, len_a, j, len_b))
+    return opcodes
+
+def iter_hunks(opcodes: List[Opcode], context: int = 3):
+    """
+    Yields hunks of changes with up to `context` equal lines around them
+    (same rules as difflib.SequenceMatcher.get_grouped_opcodes), one at a
+    time so callers can render and discard each hunk. Yields nothing when
+    there are no changes.
+    """
+    codes = list(opcodes)
+    if not any(op[0] != 'equal' for op in codes):
+        return
+    if codes[0][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = (tag, max(i1, i2 - context), i2, max(j1, j2 - context), j2)
+    if codes[-1][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = (tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context))
+
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        # Long unchanged stretches end the current hunk
+        if tag == 'equal' and i2 - i1 > 2 * context:
+            group.append((tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - context), max(j1, j2 - context)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == 'equal'):
+        yield group
+
+def group_hunks(opcodes: List[Opcode], context: int = 3) -> List[List[Opcode]]:
+    """All hunks of iter_hunks as a list. Returns [] when there are no changes."""
+    return list(iter_hunks(opcodes, context))
+
+_WORD_RE = re.compile(r'\s+|\w+|[^\w\s]')
+
+def intraline_diff(old_line: str, new_line: str):
+    """
+    Word-level diff of a replaced line pair. Returns (old_segments, new_segments),
+    each a list of (changed, text) tuples covering the whole line.
+    """
+    old_words = _WORD_RE.findall(old_line)
+    new_words = _WORD_RE.findall(new_line)
+    old_segments, new_segments = [], []
+    for tag, i1, i2, j1, j2 in diff_opcodes(old_words, new_words):
+        if i2 > i1:
+            old_segments.append((tag != 'equal', "".join(old_words[i1:i2])))
+        if j2 > j1:
+            new_segments.append((tag != 'equal', "".join(new_words[j1:j2])))
+    return old_segments, new_segments
+
+def iter_side_by_side(a: Sequence[str], b: Sequence[str], opcodes, intraline: bool = True):
+    """
+    Turns opcodes into side-by-side rows for renderers:
+    (tag, old_no, old_segments, new_no, new_segments), where line numbers are
+    1-based (None for a blank cell) and segments are (changed, text) tuples.
+    Replaced lines are paired up and, with intraline=True, word-diffed.
+    """
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            for offset in range(i2 - i1):
+                yield tag, i1 + offset + 1, [(False, a[i1 + offset])], j1 + offset + 1, [(False, b[j1 + offset])]
+        elif tag == 'delete':
+            for i in range(i1, i2):
+                yield tag, i + 1, [(True, a[i])], None, None
+        elif tag == 'insert':
+            for j in range(j1, j2):
+                yield tag, None, None, j + 1, [(True, b[j])]
+        else:
+            for offset in range(max(i2 - i1, j2 - j1)):
+                i, j = i1 + offset, j1 + offset
+                old = a[i] if i < i2 else None
+                new = b[j] if j < j2 else None
+                if intraline and old is not None and new is not None:
+                    old_segments, new_segments = intraline_diff(old, new)
+                else:
+                    old_segments = [(True, old)] if old is not None else None
+                    new_segments = [(True, new)] if new is not None else None
+                yield (tag, i + 1 if old is not None else None, old_segments,
+                       j + 1 if new is not None else None, new_segments)
+
+# End of diff_engine.py
@@ -0,0 +1,100 @@
+# src/discovery.py
+
+import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urldefrag, urlparse
+from bs4 import BeautifulSoup, SoupStrainer
+from src.downloader import fetch_page, is_download_error, HTML_PARSER
+from src.database_manager import upsert_tracked_rules
+from src import metrics
+
+# Rulebook discovery: crawls rulebook index pages breadth first and records
+# every rule page they link to in the tracked_rules table. Pages are fetched
+# through fetch_page, so the per-host politeness limits (and --record /
+# --replay) apply exactly as for tracking.
+DISCOVERY_SEEDS = [
+    "https://www.finra.org/rules-guidance/rulebooks/finra-rules",
+]
+
+# A rule page: /rules-guidance/rulebooks/<rulebook>/<rule number>
+RULE_PATH_RE = re.compile(r'^/rules-guidance/rulebooks/(?P<rulebook>[a-z0-9-]+)/(?P<number>\d+(?:[.-]\d+)*)/?$', re.IGNORECASE)
+# Rule id prefix per rulebook (anything else uses the rulebook slug in upper case)
+RULEBOOK_PREFIXES = {'finra-rules': 'FINRA'}
+
+# Link levels followed from a seed (index -> series listing -> rule), and a cap on pages fetched
+MAX_DEPTH = 2
+MAX_PAGES = 500
+
+_NUMBER_PREFIX_RE = re.compile(r'^\s*(?:rule\s+)?\d[\w.-]*\.?\s*', re.IGNORECASE)
+
+
+def rule_from_link(url, text):
+    """The tracked-rule dict for a link to a rule page, or None if it isn't one."""
+    match = RULE_PATH_RE.match(urlparse(url).path)
+    if not match:
+        return None
+    rulebook, number = match.group('rulebook').lower(), match.group('number')
+    prefix = RULEBOOK_PREFIXES.get(rulebook, rulebook.upper())
+    name = _NUMBER_PREFIX_RE.sub('', " ".join(text.split()))
+    return {'id': f"{prefix}-{number}", 'name': name or f"Rule {number}", 'url': url.rstrip('/'), 'rulebook': rulebook}
+
+
+def _page_links(page):
+    """(absolute url without fragment, anchor text) for every link on a fetched page."""
+    soup = BeautifulSoup(page['content'], HTML_PARSER, parse_only=SoupStrainer('a'))
+    for anchor in soup.find_all('a', href=True):
+        yield urldefrag(urljoin(page['url'], anchor['href']))[0], anchor.get_text()
+
+
+def _in_scope(url, seeds):
+    parsed = urlparse(url)
+    return any(parsed.netloc == urlparse(seed).netloc and parsed.path.startswith(urlparse(seed).path)
+               for seed in seeds)
+
+
+def discover_rules(seeds=None, workers=4, max_depth=MAX_DEPTH, max_pages=MAX_PAGES):
+    """
+    Crawls from the seed pages, one link level at a time (each level fetched
+    by `workers` threads), following links that stay under a seed's path.
+    Returns the rules found, keyed by id. Rule pages are recorded but only
+    fetched if they are themselves within max_depth of a seed.
+    """
+    seeds = seeds or DISCOVERY_SEEDS
+    found = {}
+    seen = set(seeds)
+    level = list(seeds)
+    fetched = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for depth in range(max_depth):
+            level = level[:max(0, max_pages - fetched)]
+            if not level:
+                break
+            print(f"Discovery: fetching {len(level)} page(s) at depth {depth}...")
+            next_level = []
+            for url, page in zip(level, pool.map(fetch_page, level)):
+                fetched += 1
+                metrics.incr('discovery_pages')
+                if isinstance(page, str) and is_download_error(page):
+                    print(f"Discovery: skipping {url}: {page}")
+                    continue
+                for link, text in _page_links(page):
+                    rule = rule_from_link(link, text)
+                    # A rule is often linked several times; the longest link text is usually its title
+                    if rule and (rule['id'] not in found or len(rule['name']) > len(found[rule['id']]['name'])):
+                        found[rule['id']] = rule
+                    if link not in seen and _in_scope(link, seeds):
+                        seen.add(link)
+                        next_level.append(link)
+            level = next_level
+    print(f"Discovery: {len(found)} rule page(s) found on {fetched} fetched page(s).")
+    return found
+
+
+def run_discovery(seeds=None, workers=4):
+    """Crawls the seeds and stores what was found in tracked_rules. Returns the number of new rules."""
+    found = discover_rules(seeds, workers)
+    added = upsert_tracked_rules(found.values(), source='discovered')
+    print(f"Discovery: {added} new rule(s) added to tracking, {len(found) - added} already known.")
+    return added
+
+# End of discovery.py
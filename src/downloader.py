@@ -1,52 +1,277 @@
 # src/downloader.py
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup, SoupStrainer
+from urllib.parse import urlparse
+import hashlib
+import threading
 import time
+from src.database_manager import get_fetch_state, save_fetch_state
+from src import metrics
+from src import http_archive
 
-def download_rule(url):
+# Use a very standard 'Real Person' User-Agent
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
+    'Referer': 'https://www.google.com/'
+}
+
+# lxml is several times faster than the pure-Python parser; use it when installed
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
+# Where the rule text lives, tried in order. Per-host defaults; a rule in
+# tracked_rules.json can override them with its own "selectors" list, e.g.
+#   "selectors": [{"tag": "div", "class": "rule-book-content"}]
+DEFAULT_SELECTORS = [
+    {'tag': 'div', 'class': 'rule-book-content'},
+    {'tag': 'div', 'class': 'field-item even'},
+    {'tag': 'div', 'id': 'block-system-main'},
+]
+SITE_SELECTORS = {
+    'www.finra.org': DEFAULT_SELECTORS,
+}
+
+# Returned by download_rule(conditional=True) when the page has not changed
+# since the last successful fetch (HTTP 304 or identical raw body).
+NOT_MODIFIED = object()
+
+# Politeness defaults, applied per host (e.g. www.finra.org)
+REQUESTS_PER_SECOND = 1.0
+MAX_IN_FLIGHT = 2
+
+
+class HostLimiter:
     """
-    Downloads rule text. Includes heavy error handling and fallbacks.
+    Politeness limiter for a single host: caps the number of requests in flight
+    and spaces request starts so we never exceed `rate` requests per second.
+    """
+
+    def __init__(self, rate: float, max_in_flight: int):
+        self.min_interval = 1.0 / rate if rate > 0 else 0.0
+        self.slots = threading.BoundedSemaphore(max_in_flight)
+        self.lock = threading.Lock()
+        self.next_start = 0.0
+
+    def __enter__(self):
+        self.slots.acquire()
+        # Reserve the next start time under the lock, then sleep outside it
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self.min_interval
+        delay = start - now
+        if delay > 0:
+            time.sleep(delay)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.slots.release()
+        return False
+
+
+_sessions = {}
+_limiters = {}
+_registry_lock = threading.Lock()
+
+
+def configure_politeness(requests_per_second: float = None, max_in_flight: int = None):
+    """Change the per-host limits. Hosts already contacted are reset."""
+    global REQUESTS_PER_SECOND, MAX_IN_FLIGHT
+    with _registry_lock:
+        if requests_per_second is not None:
+            REQUESTS_PER_SECOND = requests_per_second
+        if max_in_flight is not None:
+            MAX_IN_FLIGHT = max_in_flight
+        _limiters.clear()
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def _get_host_resources(url):
+    """Return the (session, limiter) pair for the URL's host, creating it once."""
+    host = urlparse(url).netloc
+    with _registry_lock:
+        if host not in _sessions:
+            # One keep-alive pool per host, sized to the in-flight limit
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_IN_FLIGHT)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update(HEADERS)
+            _sessions[host] = session
+            _limiters[host] = HostLimiter(REQUESTS_PER_SECOND, MAX_IN_FLIGHT)
+        return _sessions[host], _limiters[host]
+
+
+def is_download_error(text):
+    """True if download_rule returned one of its error messages instead of rule text."""
+    if text is NOT_MODIFIED:
+        return False
+    return not text or text.startswith(("Error", "Connection Error"))
+
+
+def selectors_for(url):
+    """Default extraction selectors for the URL's host."""
+    return SITE_SELECTORS.get(urlparse(url).netloc, DEFAULT_SELECTORS)
+
+
+def _selector_matches(selector, name, attrs):
+    if name != selector.get('tag', name):
+        return False
+    if 'id' in selector and attrs.get('id') != selector['id']:
+        return False
+    if 'class' in selector:
+        classes = attrs.get('class') or ''
+        if isinstance(classes, str):
+            classes = classes.split()
+        if not set(selector['class'].split()) <= set(classes):
+            return False
+    return True
+
+
+def _container_strainer(selectors):
+    """SoupStrainer that only builds the subtrees of the candidate rule containers."""
+    tag_names = {sel.get('tag') for sel in selectors}
+
+    def matches(name, attrs=None):
+        # Newer bs4 releases only pass the tag name here; fall back to a name match
+        if attrs is None:
+            return None in tag_names or name in tag_names
+        return any(_selector_matches(sel, name, attrs) for sel in selectors)
+
+    return SoupStrainer(matches)
+
+
+def extract_rule_text(content, selectors=None):
+    """
+    Pulls the rule text out of a page. Only the candidate containers are
+    parsed (SoupStrainer), falling back to a paragraph-only parse when none
+    of them holds enough text. Returns '' if nothing readable was found.
+    """
+    selectors = selectors or DEFAULT_SELECTORS
+
+    # Try the specific containers first, in selector order
+    soup = BeautifulSoup(content, HTML_PARSER, parse_only=_container_strainer(selectors))
+    text = ""
+    for sel in selectors:
+        attrs = {key: value for key, value in sel.items() if key in ('id', 'class')}
+        target = soup.find(sel.get('tag'), attrs=attrs) if attrs else soup.find(sel.get('tag'))
+        if target:
+            text = target.get_text(separator='\n').strip()
+            break
+
+    # FALLBACK: If specific targets failed, grab all paragraph text (one get_text per paragraph)
+    if len(text) < 100:
+        soup = BeautifulSoup(content, HTML_PARSER, parse_only=SoupStrainer('p'))
+        paragraphs = (p.get_text().strip() for p in soup.find_all('p'))
+        text = "\n\n".join(p for p in paragraphs if len(p) > 20)
+
+    return text
+
+
+def fetch_page(url, conditional=False):
+    """
+    The network half of download_rule. Returns a dict with the url, raw
+    content and the validators to remember (etag, last_modified, body_hash),
+    or NOT_MODIFIED, or an error string (see is_download_error).
     """
-    # Use a very standard 'Real Person' User-Agent
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
-        'Referer': 'https://www.google.com/'
-    }
-    
+    request_headers = {}
+    # A replay re-runs archived pages through the parser (e.g. after a parser or
+    # diff change), so the stored validators and body hash must not skip them
+    previous = get_fetch_state(url) if conditional and not http_archive.replaying() else None
+    # While recording, always ask for the full body so the archive can replay it
+    if previous and not http_archive.recording():
+        if previous['etag']:
+            request_headers['If-None-Match'] = previous['etag']
+        if previous['last_modified']:
+            request_headers['If-Modified-Since'] = previous['last_modified']
+
     try:
-        # 1. Try to connect
-        response = requests.get(url, headers=headers, timeout=15)
-        
+        # 1. Try to connect (or read the recorded response, see src/http_archive.py)
+        if http_archive.replaying():
+            response = http_archive.replay_response(url, request_headers)
+        else:
+            session, limiter = _get_host_resources(url)
+            with limiter:
+                response = session.get(url, headers=request_headers, timeout=15)
+            if http_archive.recording():
+                http_archive.record_response(url, response)
+
         # If FINRA blocks us (403 Forbidden), return a clear error
         if response.status_code == 403:
             return "Error 403: FINRA blocked the automated request. Use 'Load Test Data' to demo."
-        
+
+        if previous and response.status_code == 304:
+            metrics.incr('http_not_modified')
+            return NOT_MODIFIED
+
         response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # 2. Aggressive Text Extraction
-        # We try specific containers first, but if they fail, we grab the whole body
-        content = ""
-        
-        # Try finding the main rule container (specific to FINRA)
-        target = soup.find('div', class_='rule-book-content') or \
-                 soup.find('div', class_='field-item even') or \
-                 soup.find('div', id='block-system-main')
-                 
-        if target:
-            content = target.get_text(separator='\n').strip()
-        
-        # FALLBACK: If specific targets failed, grab all paragraph text
-        if len(content) < 100:
-            paragraphs = soup.find_all('p')
-            content = "\n\n".join([p.get_text().strip() for p in paragraphs if len(p.get_text().strip()) > 20])
-            
+        metrics.incr('bytes_fetched', len(response.content))
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        body_hash = hashlib.sha256(response.content).hexdigest()
+
+        if previous and previous['body_hash'] == body_hash:
+            # Server ignored the validators but the page is byte-for-byte the same
+            save_fetch_state(url, etag, last_modified, body_hash)
+            return NOT_MODIFIED
+
+        return {'url': url, 'content': response.content, 'etag': etag,
+                'last_modified': last_modified, 'body_hash': body_hash}
+
+    except Exception as e:
+        return f"Connection Error: {str(e)}"
+
+
+def parse_page(page, selectors=None):
+    """
+    The CPU half of download_rule: extracts the rule text from a fetch_page()
+    result. Returns the text or an error string. The page's validators are
+    not saved here: pass the page to log_new_version (fetch_state=) or
+    remember_page once the text has been handled, or a failure later in the
+    run would have the change skipped as unmodified next time.
+    """
+    try:
+        # 2. Targeted Text Extraction
+        with metrics.span('parse'):
+            content = extract_rule_text(page['content'], selectors or selectors_for(page['url']))
+
         # 3. Final Check
         if len(content) < 50:
             return "Error: Connected to page but found no readable text."
-            
+
         return content
 
     except Exception as e:
         return f"Connection Error: {str(e)}"
+
+
+def remember_page(page):
+    """Saves a fetch_page() result's validators, for a page found to hold no new version."""
+    save_fetch_state(page['url'], page['etag'], page['last_modified'], page['body_hash'])
+
+
+def download_rule(url, conditional=False, selectors=None):
+    """
+    Downloads rule text. Includes heavy error handling and fallbacks.
+    Safe to call from several threads: requests to the same host share a
+    pooled session and are throttled by that host's HostLimiter.
+
+    With conditional=True the stored ETag/Last-Modified are sent along and
+    NOT_MODIFIED is returned, without parsing, on a 304 or when the raw body
+    hashes the same as last time. Only use it when a baseline already exists.
+    The validators of a fetched page are not saved; the tracker uses
+    fetch_page and parse_page directly to save them with the version.
+
+    selectors overrides the host's extraction rules (see SITE_SELECTORS).
+    """
+    page = fetch_page(url, conditional)
+    if page is NOT_MODIFIED or isinstance(page, str):
+        return page
+    return parse_page(page, selectors)
@@ -0,0 +1,153 @@
+# src/http_archive.py
+
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import threading
+from requests.structures import CaseInsensitiveDict
+
+# Record/replay of raw HTTP responses, so the tracker can be re-run after a
+# parsing or diff change without touching the network.
+#
+#   record - every response fetch_page gets (status, headers, body) is also
+#            written to the archive; conditional requests are not sent, so
+#            every recording holds a full body
+#   replay - fetch_page is served from the archive and never hits the network;
+#            the stored fetch state is ignored, so every page is parsed again
+#
+# Layout: one gzip file per response, <dir>/<sha256(url)[:32]>/<session>--<recorded>.gz,
+# holding a JSON header line followed by the raw body. A session is one
+# recording run; timestamps use TIME_FORMAT so names sort chronologically.
+TIME_FORMAT = "%Y%m%dT%H%M%S%f"
+
+ARCHIVE_DIR = None
+MODE = None           # None, 'record' or 'replay'
+REPLAY_AS_OF = None   # replay the newest recording at or before this (TIME_FORMAT); None = newest
+_session = None
+_index = {}           # url key -> sorted [(recorded, session, path)]
+_lock = threading.Lock()
+
+
+def timestamp(value=None):
+    """A datetime or ISO string (default: now) in TIME_FORMAT."""
+    if value is None:
+        value = datetime.datetime.now()
+    elif isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    return value.strftime(TIME_FORMAT)
+
+
+def to_iso(value):
+    """A TIME_FORMAT timestamp as an ISO string (e.g. for check_date)."""
+    return datetime.datetime.strptime(value, TIME_FORMAT).isoformat()
+
+
+def configure_archive(path=None, mode=None, as_of=None):
+    """Switch recording or replay on (mode 'record' / 'replay') or off (mode None)."""
+    global ARCHIVE_DIR, MODE, REPLAY_AS_OF, _session
+    if mode not in (None, 'record', 'replay'):
+        raise ValueError(f"Unknown archive mode: {mode}")
+    with _lock:
+        ARCHIVE_DIR, MODE = path, mode
+        REPLAY_AS_OF = timestamp(as_of) if as_of else None
+        _session = timestamp() if mode == 'record' else None
+        _index.clear()
+
+
+def recording():
+    return MODE == 'record'
+
+
+def replaying():
+    return MODE == 'replay'
+
+
+def _url_key(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()[:32]
+
+
+def _entries(url):
+    """Recordings of a URL, oldest first (caller holds _lock)."""
+    key = _url_key(url)
+    if key not in _index:
+        directory = os.path.join(ARCHIVE_DIR, key)
+        names = os.listdir(directory) if os.path.isdir(directory) else []
+        entries = []
+        for name in names:
+            if name.endswith('.gz') and '--' in name:
+                session, recorded = name[:-3].split('--', 1)
+                entries.append((recorded, session, os.path.join(directory, name)))
+        _index[key] = sorted(entries)
+    return _index[key]
+
+
+def record_response(url, response):
+    """Adds a requests response for `url` to the archive."""
+    recorded = timestamp()
+    header = {'url': url, 'status': response.status_code, 'headers': dict(response.headers),
+              'session': _session, 'recorded': recorded}
+    directory = os.path.join(ARCHIVE_DIR, _url_key(url))
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{_session}--{recorded}.gz")
+    tmp_path = f"{path}.tmp"
+    with gzip.open(tmp_path, 'wb') as f:
+        f.write(json.dumps(header).encode('utf-8') + b"\n")
+        f.write(response.content)
+    os.replace(tmp_path, path)  # a half-written recording is never replayed
+    with _lock:
+        entries = _entries(url)
+        if path not in (entry[2] for entry in entries):
+            entries.append((recorded, _session, path))
+            entries.sort()
+
+
+class ReplayedResponse:
+    """The parts of a requests.Response that fetch_page uses."""
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self.content = content
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise IOError(f"{self.status_code} Error (replayed)")
+
+
+def replay_response(url, request_headers=None):
+    """
+    The archived response for `url` (the newest recording, or the newest at or
+    before REPLAY_AS_OF). A matching If-None-Match gets a 304, as from the server.
+    Raises LookupError if the URL was never recorded.
+    """
+    with _lock:
+        entries = [e for e in _entries(url) if REPLAY_AS_OF is None or e[0] <= REPLAY_AS_OF]
+    if not entries:
+        raise LookupError(f"{url} is not in the HTTP archive")
+    with gzip.open(entries[-1][2], 'rb') as f:
+        header = json.loads(f.readline())
+        content = f.read()
+    response = ReplayedResponse(header['status'], header['headers'], content)
+    etag = response.headers.get('ETag')
+    if etag and (request_headers or {}).get('If-None-Match') == etag:
+        return ReplayedResponse(304, header['headers'], b"")
+    return response
+
+
+def sessions(path=None):
+    """[(session, last_recorded)] of every recording run in the archive, oldest first."""
+    root = path or ARCHIVE_DIR
+    last = {}
+    for key in (os.listdir(root) if root and os.path.isdir(root) else []):
+        directory = os.path.join(root, key)
+        if not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            if name.endswith('.gz') and '--' in name:
+                session, recorded = name[:-3].split('--', 1)
+                last[session] = max(last.get(session, recorded), recorded)
+    return sorted(last.items())
+
+# End of http_archive.py
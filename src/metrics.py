@@ -0,0 +1,179 @@
+# src/metrics.py
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# In-process metrics for one tracker run: timing spans per pipeline stage and
+# plain counters. Everything is kept in memory until the run ends, then
+# written as JSON lines and/or a Prometheus text-format file (the format
+# node_exporter's textfile collector picks up).
+
+METRIC_PREFIX = "rule_tracker"
+QUANTILES = (0.5, 0.9, 0.99)
+
+_lock = threading.Lock()
+_spans = []       # (stage, rule_id, start_unix, seconds)
+_counters = {}    # name -> value
+_local = threading.local()
+
+
+def reset():
+    """Drops everything recorded so far (called at the start of each run)."""
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+
+
+@contextmanager
+def span(stage: str, rule_id: str = None):
+    """
+    Times the enclosed block as one `stage` span. Nested spans inherit the
+    rule_id of the enclosing one, so code that doesn't know which rule it is
+    working on (e.g. the parser) is still attributed correctly.
+    """
+    stack = getattr(_local, 'rules', None)
+    if stack is None:
+        stack = _local.rules = []
+    rule_id = rule_id or (stack[-1] if stack else None)
+    stack.append(rule_id)
+    started = time.time()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        stack.pop()
+        with _lock:
+            _spans.append((stage, rule_id, started, seconds))
+
+
+def record(stage: str, seconds: float, rule_id: str = None):
+    """Adds a span measured elsewhere (e.g. in a worker process)."""
+    with _lock:
+        _spans.append((stage, rule_id, time.time() - seconds, seconds))
+
+
+def incr(name: str, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def snapshot():
+    """Copies of the recorded spans (as dicts) and counters."""
+    with _lock:
+        spans = [{'stage': s, 'rule_id': r, 'start': t, 'seconds': d} for s, r, t, d in _spans]
+        return {'spans': spans, 'counters': dict(_counters)}
+
+
+def _quantile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def summarize(spans):
+    """Per-stage count, total seconds, quantiles and max for a list of span dicts."""
+    by_stage = {}
+    for item in spans:
+        by_stage.setdefault(item['stage'], []).append(item['seconds'])
+    summary = {}
+    for stage, samples in sorted(by_stage.items()):
+        samples.sort()
+        summary[stage] = {
+            'count': len(samples),
+            'total_s': sum(samples),
+            'max_s': samples[-1],
+            **{f"p{int(q * 100)}_s": _quantile(samples, q) for q in QUANTILES},
+        }
+    return summary
+
+
+def rule_totals(spans):
+    """Seconds spent per rule (the outer 'rule' spans), slowest first."""
+    totals = {}
+    for item in spans:
+        if item['stage'] == 'rule' and item['rule_id']:
+            totals[item['rule_id']] = totals.get(item['rule_id'], 0.0) + item['seconds']
+    return dict(sorted(totals.items(), key=lambda kv: kv[1], reverse=True))
+
+
+def _write_atomic(path, text):
+    """Write via a temp file so scrapers never see a half-written file."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def write_jsonl(path: str, run_id: str = None):
+    """
+    Appends this run to a JSON-lines file: one line per span, then one
+    'run' line with the counters and the per-stage summary.
+    """
+    data = snapshot()
+    run_id = run_id or time.strftime("%Y%m%dT%H%M%S")
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        for item in data['spans']:
+            f.write(json.dumps({'type': 'span', 'run_id': run_id, **item}) + "\n")
+        f.write(json.dumps({'type': 'run', 'run_id': run_id, 'counters': data['counters'],
+                            'stages': summarize(data['spans'])}) + "\n")
+    return path
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus():
+    """
+    The current run's metrics in Prometheus text exposition format. Every
+    value describes the last run only (reset() clears them and the file is
+    rewritten), so all are gauges: exporting them as counters or a summary
+    would look like a counter reset every run and break rate()/increase().
+    """
+    data = snapshot()
+    name = f"{METRIC_PREFIX}_last_run_stage_seconds"
+    lines = [f"# HELP {name} Time spent per pipeline stage in the last run, by quantile.",
+             f"# TYPE {name} gauge"]
+    stages = summarize(data['spans'])
+    for stage, stats in stages.items():
+        for q in QUANTILES:
+            lines.append(f'{name}{{stage="{_label(stage)}",quantile="{q}"}} {stats[f"p{int(q * 100)}_s"]:.6f}')
+    name = f"{METRIC_PREFIX}_last_run_stage_total_seconds"
+    lines += [f"# HELP {name} Total time spent per pipeline stage in the last run.",
+              f"# TYPE {name} gauge"]
+    lines += [f'{name}{{stage="{_label(stage)}"}} {stats["total_s"]:.6f}' for stage, stats in stages.items()]
+    name = f"{METRIC_PREFIX}_last_run_stage_spans"
+    lines += [f"# HELP {name} Timed spans per pipeline stage in the last run.",
+              f"# TYPE {name} gauge"]
+    lines += [f'{name}{{stage="{_label(stage)}"}} {stats["count"]}' for stage, stats in stages.items()]
+
+    name = f"{METRIC_PREFIX}_rule_seconds"
+    lines += [f"# HELP {name} Total processing time per rule in the last run.",
+              f"# TYPE {name} gauge"]
+    for rule_id, seconds in rule_totals(data['spans']).items():
+        lines.append(f'{name}{{rule_id="{_label(rule_id)}"}} {seconds:.6f}')
+
+    for counter, value in sorted(data['counters'].items()):
+        name = f"{METRIC_PREFIX}_last_run_{counter}"
+        lines += [f"# HELP {name} {counter.replace('_', ' ').capitalize()} in the last run.",
+                  f"# TYPE {name} gauge", f"{name} {value}"]
+
+    name = f"{METRIC_PREFIX}_last_run_timestamp_seconds"
+    lines += [f"# TYPE {name} gauge", f"{name} {time.time():.0f}"]
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path: str):
+    """Overwrites `path` with render_prometheus() output."""
+    _write_atomic(path, render_prometheus())
+    return path
+
+# End of metrics.py
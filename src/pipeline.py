@@ -0,0 +1,172 @@
+# src/pipeline.py
+
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from src.checker import fetch_rule, check_page
+from src.database_manager import log_new_version
+from src.sections import summarize_sections
+from src.analyzer import plan_analysis, complete_analysis, extract_paragraph_entities
+from src.reporter import generate_html_report
+from src import metrics
+
+# Staged mode for run_tracker (--pipeline):
+#
+#   fetch threads --fetched--> parse/diff threads --process pool--> NLP + HTML report
+#                                                 \--finished--> main thread: log version
+#
+# Downloads are I/O bound and run in threads. Parsing and diffing get their
+# own threads, so slow downloads never leave them idle. NER and report
+# rendering are CPU bound and run in worker processes, outside the GIL.
+# Every hand-off is bounded by QUEUE_SIZE: a stage that gets ahead blocks
+# instead of piling up pages in memory.
+QUEUE_SIZE = 16
+
+_DONE = object()
+
+
+def _fetch_worker(rules, fetched):
+    while True:
+        try:
+            rule = rules.get_nowait()
+        except queue.Empty:
+            return
+        start = time.perf_counter()
+        try:
+            baseline_exists, page = fetch_rule(rule)
+        except Exception as e:
+            baseline_exists, page = False, f"Error: {e}"
+        fetched.put((rule, start, baseline_exists, page))  # blocks while the parse stage is behind
+
+
+def analyze_and_report(rule_id, rule_name, old_text, new_text, section_changes, missing):
+    """
+    Worker-process stage: NER for the paragraphs not in the entity cache and
+    the HTML report. Touches no database. Returns the fresh entities (None if
+    the spaCy model is unavailable), the report path and the stage timings.
+    """
+    start = time.perf_counter()
+    try:
+        fresh = dict(zip(missing, extract_paragraph_entities(list(missing.values())))) if missing else {}
+    except (OSError, ImportError):
+        fresh = None
+    nlp_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    report_path = generate_html_report(rule_id, rule_name, old_text, new_text, section_changes=section_changes)
+    return {'fresh': fresh, 'report_path': report_path,
+            'nlp_seconds': nlp_seconds, 'report_seconds': time.perf_counter() - start}
+
+
+def _parse_worker(fetched, finished, pool, slots, results, check_date):
+    while True:
+        item = fetched.get()
+        if item is _DONE:
+            return
+        rule, start, baseline_exists, page = item
+        try:
+            status, details = check_page(rule, baseline_exists, page, check_date)
+            if details is not None:
+                # Cache lookups happen here; the worker process only sees uncached paragraphs
+                details['plan'], details['missing'] = plan_analysis({rule['id']: details['changes']})
+        except Exception as e:
+            print(f"[{rule['id']}] Unexpected error: {e}")
+            status, details = 'failed', None
+
+        if details is None:
+            results.append((rule['id'], status, time.perf_counter() - start))
+            continue
+        slots.acquire()  # caps how many changed rules are held for analysis at once
+        future = pool.submit(analyze_and_report, rule['id'], rule['name'], details['old_text'],
+                             details['new_text'], details['section_changes'], details['missing'])
+        finished.put((rule, start, details, future))
+
+
+def _finish_rule(rule, details, outcome, check_date=None):
+    """Main-thread stage: cache the new entities and log the version with its diff and analysis."""
+    rule_id = rule['id']
+    metrics.record('nlp', outcome['nlp_seconds'], rule_id)
+    metrics.record('report', outcome['report_seconds'], rule_id)
+    analysis = None
+    if outcome['fresh'] is None:
+        print(f"[{rule_id}] Skipping NLP analysis: spaCy model unavailable.")
+    else:
+        analysis = complete_analysis(details['plan'], outcome['fresh'])[rule_id]
+
+    summary = summarize_sections(details['section_changes'])
+    with metrics.span('db_write', rule_id=rule_id):
+        version_id = log_new_version(rule_id, details['new_text'],
+                                     summary=f"Changes detected ({summary}). Report: {outcome['report_path']}",
+                                     section_changes=details['section_changes'], analysis=analysis,
+                                     check_date=check_date, fetch_state=details['fetch_state'])
+    if version_id is None:
+        raise RuntimeError("the new version could not be logged")
+    print(f"[{rule_id}] HTML Redline Report generated at: {outcome['report_path']}")
+    return analysis
+
+
+def run_pipeline(rules, fetch_workers=4, parse_workers=2, cpu_processes=2, check_date=None):
+    """
+    Checks the rules with the staged pipeline described above. Returns
+    (results, analyses): (rule_id, status, seconds) tuples in completion
+    order, and rule_id -> NLP analysis for the changed rules. check_date
+    stamps the new versions (default: now).
+    """
+    pending = queue.Queue()
+    for rule in rules:
+        pending.put(rule)
+    fetched = queue.Queue(maxsize=QUEUE_SIZE)
+    # Entries here each hold a slot, so this queue is bounded by `slots` too
+    finished = queue.Queue()
+    slots = threading.BoundedSemaphore(QUEUE_SIZE)
+    results = []
+    analyses = {}
+
+    # 'spawn': workers must not inherit this process's SQLite connections
+    pool = ProcessPoolExecutor(max_workers=cpu_processes, mp_context=multiprocessing.get_context('spawn'))
+    fetchers = [threading.Thread(target=_fetch_worker, args=(pending, fetched), daemon=True)
+                for _ in range(fetch_workers)]
+    parsers = [threading.Thread(target=_parse_worker, args=(fetched, finished, pool, slots, results, check_date), daemon=True)
+               for _ in range(parse_workers)]
+
+    def shut_down_stages():
+        for thread in fetchers:
+            thread.join()
+        for _ in parsers:
+            fetched.put(_DONE)
+        for thread in parsers:
+            thread.join()
+        finished.put(_DONE)
+
+    for thread in fetchers + parsers:
+        thread.start()
+    threading.Thread(target=shut_down_stages, daemon=True).start()
+
+    try:
+        while True:
+            item = finished.get()
+            if item is _DONE:
+                break
+            rule, start, details, future = item
+            try:
+                analysis = _finish_rule(rule, details, future.result(), check_date)
+                if analysis is not None:
+                    analyses[rule['id']] = analysis
+                status = 'changed'
+            except Exception as e:
+                print(f"[{rule['id']}] Unexpected error: {e}")
+                status = 'failed'
+            finally:
+                slots.release()
+            results.append((rule['id'], status, time.perf_counter() - start))
+    finally:
+        pool.shutdown()
+
+    for rule_id, status, seconds in results:
+        metrics.record('rule', seconds, rule_id)
+        metrics.incr(f"rules_{status}")
+    return results, analyses
+
+# End of pipeline.py
@@ -0,0 +1,40 @@
+# src/provenance.py
+
+import json
+from typing import List
+from src.diff_engine import diff_opcodes
+
+# Line provenance ("blame"): for every line of a version, the id of the version
+# that introduced it. It is carried forward one version at a time, so writing
+# a version costs one diff against its predecessor and reading costs one row.
+# Stored run-length encoded: [[origin_version_id, line_count], ...].
+
+def carry_origins(old_origins: List[int], old_lines: List[str], new_lines: List[str], version_id: int) -> List[int]:
+    """
+    Origins of new_lines, given those of old_lines: unchanged lines keep their
+    origin, inserted or modified lines get version_id.
+    """
+    origins = []
+    for tag, i1, i2, j1, j2 in diff_opcodes(old_lines, new_lines):
+        if tag == 'equal':
+            origins.extend(old_origins[i1:i2])
+        else:
+            origins.extend([version_id] * (j2 - j1))
+    return origins
+
+def encode_runs(origins: List[int]) -> str:
+    runs = []
+    for origin in origins:
+        if runs and runs[-1][0] == origin:
+            runs[-1][1] += 1
+        else:
+            runs.append([origin, 1])
+    return json.dumps(runs, separators=(',', ':'))
+
+def decode_runs(payload: str) -> List[int]:
+    origins = []
+    for origin, count in json.loads(payload):
+        origins.extend([origin] * count)
+    return origins
+
+# End of provenance.py
@@ -1,58 +1,149 @@
 # src/reporter.py
 
-import difflib
+import html
 import os
 from datetime import datetime
+from src.diff_engine import diff_opcodes, iter_hunks, iter_side_by_side
+from src.sections import section_label, section_opcodes, summarize_sections
 
-def generate_html_report(rule_id, rule_name, old_text, new_text):
-    """
-    Generates a side-by-side HTML comparison (redline) of the old vs new text.
-    Saves the file to the 'reports/' directory.
-    """
-    print(f"[{rule_id}] Generating HTML redline report...")
-    
-    # 1. Prepare the Data
-    # difflib expects lists of strings (lines), not big text blocks
-    old_lines = old_text.splitlines()
-    new_lines = new_text.splitlines()
-    
-    # 2. Configure the HTML Generator
-    d = difflib.HtmlDiff()
-    
-    # 3. Generate the HTML content
-    # We provide a custom header and styling tweaks via 'wrapcolumn' if needed
-    html_content = d.make_file(
-        old_lines, 
-        new_lines, 
-        fromdesc=f"Baseline Version ({rule_id})", 
-        todesc=f"New Version ({datetime.now().strftime('%Y-%m-%d')})",
-        context=True,  # Show context lines around changes? (False = show everything)
-        numlines=5     # If context=True, how many lines of context to show
-    )
-    
-    # 4. Save to File
-    filename = f"reports/{rule_id}_CHANGE_REPORT.html"
-    
-    # We can inject a little CSS to make it look modern
-    # The default difflib style is a bit 1990s
-    custom_css = """
+# Lines of unchanged context shown around each change
+CONTEXT_LINES = 5
+
+# We inject a little CSS to make it look modern
+REPORT_CSS = """
     <style>
         body { font-family: 'Helvetica Neue', Helvetica, Arial, sans-serif; padding: 20px; }
         h1 { color: #333; }
+        table.diff { border-collapse: collapse; width: 100%; font-family: Menlo, Consolas, monospace; font-size: 12px; }
+        table.diff td { padding: 2px 6px; vertical-align: top; white-space: pre-wrap; word-break: break-word; }
         .diff_header { background-color: #e0e0e0; }
-        td.diff_header { text-align: right; }
-        .diff_next { display: none; }
+        td.diff_header { text-align: right; width: 1%; }
+        th.diff_header { text-align: left; padding: 6px; }
+        tr.diff_gap td { background-color: #f4f4f4; color: #888; text-align: center; }
         .diff_add { background-color: #d4fcbc; }
         .diff_chg { background-color: #ffffcc; }
         .diff_sub { background-color: #ffcccc; }
+        tr.diff_section th { background-color: #333; color: #fff; text-align: left; padding: 6px; }
+        p.sections { color: #555; }
     </style>
+"""
+
+def _render_segments(segments, css_class):
+    parts = []
+    for changed, text in segments:
+        text = html.escape(text)
+        parts.append(f'<span class="{css_class}">{text}</span>' if changed else text)
+    return "".join(parts)
+
+def _render_cells(line_no, segments, css_class):
+    """Line number cell plus the escaped line, with changed segments highlighted."""
+    if segments is None:
+        return '<td class="diff_header"></td><td></td>'
+    return f'<td class="diff_header">{line_no}</td><td>{_render_segments(segments, css_class)}</td>'
+
+def _render_row(tag, old_no, old_segments, new_no, new_segments):
+    row_class = ' class="diff_chg"' if tag == 'replace' else ''
+    old_cells = _render_cells(old_no, old_segments, 'diff_sub')
+    new_cells = _render_cells(new_no, new_segments, 'diff_add')
+    return f'<tr{row_class}>{old_cells}{new_cells}</tr>'
+
+def _render_compact_rows(tag, old_no, old_segments, new_no, new_segments):
+    """Compact mode: one column, removed line then added line, no context."""
+    rows = []
+    if old_segments is not None:
+        rows.append(f'<tr><td class="diff_header">-{old_no}</td><td>{_render_segments(old_segments, "diff_sub")}</td></tr>')
+    if new_segments is not None:
+        rows.append(f'<tr><td class="diff_header">+{new_no}</td><td>{_render_segments(new_segments, "diff_add")}</td></tr>')
+    return rows
+
+def _section_blocks(old_lines, new_lines, section_changes):
+    """(header, opcodes) per changed section, opcodes in whole-text line numbers."""
+    for change in section_changes:
+        if change['status'] == 'renumbered':
+            continue
+        # compare_sections() and the version_diffs table already carry the opcodes
+        opcodes = change.get('opcodes')
+        if opcodes is None:
+            opcodes = section_opcodes(old_lines, new_lines, change)
+        yield f"{html.escape(section_label(change['path']))} &mdash; {change['status']}", opcodes
+
+def generate_html_report(rule_id, rule_name, old_text, new_text, compact=False, output_dir="reports",
+                         section_changes=None):
     """
+    Generates a side-by-side HTML comparison (redline) of the old vs new text.
+    Saves the file to the 'reports/' directory.
+
+    Rows are written to the file hunk by hunk as they are rendered, so memory
+    for the output is bounded by the largest hunk rather than the whole report.
+    With compact=True only the changed lines are written, in a single column.
+
+    section_changes (from sections.compare_sections) restricts the report to
+    the changed subsections, each under its own heading, with a summary of
+    which subsections were amended, added or removed.
+    """
+    print(f"[{rule_id}] Generating HTML redline report...")
     
-    # Inject CSS into the head
-    html_content = html_content.replace('<head>', f'<head>{custom_css}')
+    # 1. Prepare the Data
+    # The diff engine expects lists of strings (lines), not big text blocks
+    old_lines = old_text.splitlines()
+    new_lines = new_text.splitlines()
+    
+    # 2. Diff once (or once per changed section); hunks are produced lazily
+    if section_changes is None:
+        blocks = [(None, diff_opcodes(old_lines, new_lines))]
+    else:
+        blocks = _section_blocks(old_lines, new_lines, section_changes)
     
+    # 3. Stream the HTML out (replaced lines get word-level highlights)
+    os.makedirs(output_dir, exist_ok=True)
+    filename = f"{output_dir}/{rule_id}_CHANGE_REPORT.html"
+    fromdesc = html.escape(f"Baseline Version ({rule_id})")
+    todesc = f"New Version ({datetime.now().strftime('%Y-%m-%d')})"
+    columns = 2 if compact else 4
+    sections_html = f'<p class="sections">{html.escape(summarize_sections(section_changes))}</p>' if section_changes else ''
+    if compact:
+        table_header = f'<tr><th class="diff_header" colspan="2">{fromdesc} &rarr; {todesc}</th></tr>'
+    else:
+        table_header = f'<tr><th class="diff_header" colspan="2">{fromdesc}</th><th class="diff_header" colspan="2">{todesc}</th></tr>'
+
     with open(filename, 'w', encoding='utf-8') as f:
-        f.write(html_content)
+        f.write(f"""<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <title>{html.escape(rule_id)} Change Report</title>
+{REPORT_CSS}
+</head>
+<body>
+    <h1>{html.escape(rule_id)}: {html.escape(rule_name)}</h1>
+    {sections_html}
+    <table class="diff">
+        <thead>{table_header}</thead>
+        <tbody>
+""")
+        hunk_count = 0
+        for header, opcodes in blocks:
+            if header:
+                f.write(f'<tr class="diff_section"><th colspan="{columns}">{header}</th></tr>\n')
+            for block_hunk, hunk in enumerate(iter_hunks(opcodes, context=0 if compact else CONTEXT_LINES)):
+                rows = []
+                if block_hunk:
+                    rows.append(f'<tr class="diff_gap"><td colspan="{columns}">&hellip;</td></tr>')
+                for row in iter_side_by_side(old_lines, new_lines, hunk):
+                    if compact:
+                        rows.extend(_render_compact_rows(*row))
+                    else:
+                        rows.append(_render_row(*row))
+                f.write("\n".join(rows))
+                f.write("\n")
+                hunk_count += 1
+        if not hunk_count:
+            f.write(f'<tr class="diff_gap"><td colspan="{columns}">No Differences Found</td></tr>\n')
+        f.write("""        </tbody>
+    </table>
+</body>
+</html>
+""")
         
     print(f"[{rule_id}] Report saved: {filename}")
     return filename
@@ -0,0 +1,126 @@
+# src/scheduler.py
+
+import datetime
+import heapq
+import random
+import time
+from urllib.parse import urlparse
+from src.database_manager import get_version_history
+
+# Adaptive polling for daemon mode. Every stored version is a detected change,
+# so the check_date column of rule_versions is each rule's change history.
+# A rule is polled CHECKS_PER_CHANGE times per expected gap between changes:
+# active rules come round often, rules that have been quiet for years rarely.
+MIN_INTERVAL = 15 * 60              # never poll a rule more often than this
+MAX_INTERVAL = 7 * 24 * 3600        # ...or less often than this
+CHECKS_PER_CHANGE = 4
+HISTORY_WINDOW = 10                 # most recent changes used for the average gap
+JITTER = 0.1                        # +/- fraction applied to every interval
+STARTUP_SPREAD = 60                 # first checks are spread over this many seconds
+
+# Backoff after failures, doubled per consecutive failure up to MAX_BACKOFF.
+# A 403 means the regulator is pushing back, so it pauses the whole host.
+ERROR_BACKOFF = 5 * 60
+FORBIDDEN_BACKOFF = 30 * 60
+MAX_BACKOFF = 24 * 3600
+
+
+def _parse_date(value):
+    try:
+        return datetime.datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def adaptive_interval(change_times, now=None):
+    """
+    Seconds until the next check of a rule, from the unix timestamps of its
+    stored versions. The expected gap between changes is the mean of the
+    recent gaps, or the time since the last change if that is longer (a rule
+    that has gone quiet is treated as having slowed down).
+    """
+    now = now or time.time()
+    times = sorted(t for t in change_times if t is not None)[-(HISTORY_WINDOW + 1):]
+    if not times:
+        return MIN_INTERVAL
+
+    since_last = max(0.0, now - times[-1])
+    gaps = [later - earlier for earlier, later in zip(times, times[1:])]
+    expected_gap = max(sum(gaps) / len(gaps), since_last) if gaps else since_last
+    return min(MAX_INTERVAL, max(MIN_INTERVAL, expected_gap / CHECKS_PER_CHANGE))
+
+
+def history_interval(rule_id, now=None):
+    """adaptive_interval() for a rule, read from its stored version dates."""
+    dates = [_parse_date(item['check_date']) for item in get_version_history(rule_id)]
+    return adaptive_interval(dates, now)
+
+
+def _jittered(seconds):
+    return seconds * random.uniform(1 - JITTER, 1 + JITTER)
+
+
+class RuleScheduler:
+    """
+    Priority queue of next-check times (heapq of (due, seq, rule_id)).
+    pop_due() hands out the rules whose time has come; record() reschedules
+    a rule from the outcome of its check.
+    """
+
+    def __init__(self, rules, now=None):
+        now = now or time.time()
+        self.rules = {rule['id']: rule for rule in rules}
+        self.heap = []
+        self.seq = 0
+        self.failures = {}
+        self.host_paused_until = {}
+        for rule_id in self.rules:
+            self._push(rule_id, now + random.uniform(0, STARTUP_SPREAD))
+
+    def _push(self, rule_id, due):
+        self.seq += 1
+        heapq.heappush(self.heap, (due, self.seq, rule_id))
+
+    def _host(self, rule_id):
+        return urlparse(self.rules[rule_id]['url']).netloc
+
+    def next_due(self):
+        """Timestamp of the earliest scheduled check, or None if nothing is scheduled."""
+        return self.heap[0][0] if self.heap else None
+
+    def pop_due(self, now=None):
+        """Removes and returns the rules due by `now`. Rules on a paused host are pushed back."""
+        now = now or time.time()
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            _, _, rule_id = heapq.heappop(self.heap)
+            paused_until = self.host_paused_until.get(self._host(rule_id), 0)
+            if paused_until > now:
+                self._push(rule_id, paused_until + random.uniform(0, STARTUP_SPREAD))
+            else:
+                due.append(self.rules[rule_id])
+        return due
+
+    def record(self, rule_id, status, now=None):
+        """
+        Reschedules a checked rule. 'failed' backs off exponentially,
+        'blocked' (HTTP 403) also pauses every rule on the same host;
+        anything else resets the backoff and uses the adaptive interval.
+        Returns the delay in seconds.
+        """
+        now = now or time.time()
+        if status in ('failed', 'blocked'):
+            failures = self.failures.get(rule_id, 0) + 1
+            self.failures[rule_id] = failures
+            base = FORBIDDEN_BACKOFF if status == 'blocked' else ERROR_BACKOFF
+            delay = _jittered(min(MAX_BACKOFF, base * 2 ** (failures - 1)))
+            if status == 'blocked':
+                host = self._host(rule_id)
+                self.host_paused_until[host] = max(self.host_paused_until.get(host, 0), now + delay)
+        else:
+            self.failures.pop(rule_id, None)
+            delay = _jittered(history_interval(rule_id, now))
+        self._push(rule_id, now + delay)
+        return delay
+
+# End of scheduler.py
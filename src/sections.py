@@ -0,0 +1,230 @@
+# src/sections.py
+
+import hashlib
+import re
+from typing import Dict, List
+from src.comparator import opcode_lines
+from src.diff_engine import diff_opcodes
+
+# FINRA rules are organised as (a) > (1) > (A) > (i), followed by
+# "Supplementary Material" with numbered items (.01, .02, ...). Every line that
+# starts with one of these markers opens a new section; its own text runs up
+# to the next marker. Text before the first marker is the preamble (path '').
+SECTION_START_RE = re.compile(
+    r'^[ \t]*(?:(?P<supplementary>[•·.*\- \t]*(?i:supplementary material)\b)'
+    r'|\.(?P<item>\d{2})(?=\s|$)'
+    r'|\((?P<label>[a-z]{1,4}|[A-Z]{1,2}|\d{1,3})\)(?=\s|$))',
+    re.MULTILINE
+)
+LEADING_MARKER_RE = re.compile(r'^(?:\((?:[a-z]{1,4}|[A-Z]{1,2}|\d{1,3})\)|\.\d{2})(?=\s|$)')
+ROMAN_RE = re.compile(r'^[ivxl]+$')
+
+# Nesting depth of each marker kind
+LEVELS = {'lower': 1, 'digit': 2, 'upper': 3, 'roman': 4, 'supplementary': 1, 'item': 2}
+
+_ROMAN_NEXT = {'i': 'ii', 'v': 'vi', 'x': 'xi'}
+
+def _classify(match, next_match, stack):
+    """(kind, label) of a SECTION_START_RE match, given the open sections."""
+    if match.group('supplementary'):
+        return 'supplementary', 'Supplementary Material'
+    if match.group('item'):
+        return 'item', match.group('item')
+    label = match.group('label')
+    if label.isdigit():
+        return 'digit', label
+    if label.isupper():
+        return 'upper', label
+    # (i), (v), (x) are roman numerals under an (A)-level section, letters otherwise.
+    # When they could also be the next top-level letter ((h) -> (i)), they are
+    # only taken as roman if (ii), (vi) or (xi) follows.
+    if ROMAN_RE.match(label) and stack and stack[-1][0] in ('upper', 'roman'):
+        letters = [entry[1] for entry in stack if entry[0] == 'lower']
+        is_next_letter = len(label) == 1 and letters and ord(label) == ord(letters[0][-1]) + 1
+        if not is_next_letter or (next_match is not None and next_match.group('label') == _ROMAN_NEXT.get(label)):
+            return 'roman', label
+    return 'lower', label
+
+def _path_part(kind, label):
+    if kind == 'supplementary':
+        return label
+    if kind == 'item':
+        return f" .{label}"
+    return f"({label})"
+
+def _body_hash(text):
+    """Whitespace-insensitive hash of a section's own text, leading marker removed (survives renumbering)."""
+    text = LEADING_MARKER_RE.sub('', " ".join(text.split()), count=1)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def parse_sections(text: str) -> List[Dict]:
+    """
+    Splits rule text into its section tree, flattened in document order.
+    Each section is a dict with path (e.g. '(b)(2)(A)'), level, parent (path
+    of the enclosing section, '' at the top level, None for the preamble),
+    start/end (own line range in text.splitlines()), hash (own text, marker
+    excluded) and tree_hash (own text plus every subsection).
+    """
+    lines = text.splitlines()
+    joined = "\n".join(lines)  # same lines as splitlines(), but only '\n' breaks
+    sections = [{'path': '', 'level': 0, 'parent': None, 'start': 0, 'end': len(lines)}]
+    offsets = [0]     # character offset of each section in `joined`
+    parents = [None]  # index of each section's parent in `sections`
+    stack = []        # open sections: (kind, label, index, path)
+
+    # One regex pass finds every marker line; no per-line Python work
+    matches = list(SECTION_START_RE.finditer(joined))
+    line_no, line_pos = 0, 0
+    for n, match in enumerate(matches):
+        kind, label = _classify(match, matches[n + 1] if n + 1 < len(matches) else None, stack)
+        while stack and LEVELS[stack[-1][0]] >= LEVELS[kind]:
+            stack.pop()
+        parent = stack[-1][3] if stack else ''
+        parents.append(stack[-1][2] if stack else 0)
+        path = parent + _path_part(kind, label)
+        stack.append((kind, label, len(sections), path))
+
+        line_no += joined.count("\n", line_pos, match.start())
+        line_pos = match.start()
+        sections[-1]['end'] = line_no
+        sections.append({'path': path, 'level': len(stack), 'parent': parent, 'start': line_no, 'end': len(lines)})
+        offsets.append(match.start())
+
+    offsets.append(len(joined))
+    for index, section in enumerate(sections):
+        section['hash'] = _body_hash(joined[offsets[index]:offsets[index + 1]])
+
+    # Merkle-style tree hashes: children come after their parent, so go backwards
+    child_hashes = [[] for _ in sections]
+    for index in range(len(sections) - 1, -1, -1):
+        section = sections[index]
+        combined = section['hash'] + "".join(reversed(child_hashes[index]))
+        section['tree_hash'] = hashlib.sha256(combined.encode('utf-8')).hexdigest()
+        if parents[index] is not None:
+            child_hashes[parents[index]].append(section['tree_hash'])
+
+    if sections[0]['start'] == sections[0]['end'] and len(sections) > 1:
+        sections.pop(0)  # no preamble
+    return sections
+
+def diff_sections(old_text: str, new_text: str) -> List[Dict]:
+    """
+    Pairs up the sections of two versions. Returns the sections that differ,
+    in new-document order (removed ones last), as dicts with status
+    ('amended', 'added', 'removed' or 'renumbered'), path, old_path, and the
+    own line ranges old_range / new_range (None for the missing side).
+
+    Sections are first matched by identical text, so an inserted subsection
+    shows up as one 'added' plus 'renumbered' siblings rather than every
+    following sibling being 'amended'.
+    """
+    old_sections = parse_sections(old_text)
+    new_sections = parse_sections(new_text)
+
+    matched_old, matched_new = {}, {}  # index -> index on the other side
+    old_by_path = {s['path']: i for i, s in enumerate(old_sections)}
+    # 1. Same path, same text: unchanged
+    for j, section in enumerate(new_sections):
+        i = old_by_path.get(section['path'])
+        if i is not None and old_sections[i]['hash'] == section['hash']:
+            matched_old[i], matched_new[j] = j, i
+    # 2. Same text under another path: renumbered
+    old_by_hash = {}
+    for i, section in enumerate(old_sections):
+        if i not in matched_old:
+            old_by_hash.setdefault(section['hash'], []).append(i)
+    for j, section in enumerate(new_sections):
+        candidates = old_by_hash.get(section['hash'])
+        if j not in matched_new and candidates:
+            i = candidates.pop(0)
+            matched_old[i], matched_new[j] = j, i
+    # 3. Same path, different text: amended
+    for j, section in enumerate(new_sections):
+        i = old_by_path.get(section['path'])
+        if j not in matched_new and i is not None and i not in matched_old:
+            matched_old[i], matched_new[j] = j, i
+
+    changes = []
+    for j, new in enumerate(new_sections):
+        i = matched_new.get(j)
+        old = old_sections[i] if i is not None else None
+        if old is None:
+            status = 'added'
+        elif old['hash'] != new['hash']:
+            status = 'amended'
+        elif old['path'] != new['path']:
+            status = 'renumbered'
+        else:
+            continue
+        changes.append({'status': status, 'path': new['path'], 'old_path': old['path'] if old else None,
+                        'old_range': (old['start'], old['end']) if old else None,
+                        'new_range': (new['start'], new['end'])})
+    for i, old in enumerate(old_sections):
+        if i not in matched_old:
+            changes.append({'status': 'removed', 'path': old['path'], 'old_path': old['path'],
+                            'old_range': (old['start'], old['end']), 'new_range': None})
+    return changes
+
+def section_label(path: str) -> str:
+    return path or "Preamble"
+
+def summarize_sections(section_changes: List[Dict]) -> str:
+    """One line for the version log, e.g. 'Amended: (b)(1); Added: (c); Renumbered: (c) -> (d)'."""
+    parts = []
+    for status in ('amended', 'added', 'removed', 'renumbered'):
+        if status == 'renumbered':
+            paths = [f"{section_label(c['old_path'])} -> {section_label(c['path'])}"
+                     for c in section_changes if c['status'] == status]
+        else:
+            paths = [section_label(c['path']) for c in section_changes if c['status'] == status]
+        if paths:
+            parts.append(f"{status.capitalize()}: {', '.join(paths)}")
+    return "; ".join(parts)
+
+def section_opcodes(old_lines: List[str], new_lines: List[str], change: Dict):
+    """Diff opcodes of one changed section, in whole-text line numbers."""
+    o1, o2 = change['old_range'] or (0, 0)
+    n1, n2 = change['new_range'] or (0, 0)
+    return [(tag, i1 + o1, i2 + o1, j1 + n1, j2 + n1)
+            for tag, i1, i2, j1, j2 in diff_opcodes(old_lines[o1:o2], new_lines[n1:n2])]
+
+def diff_stats(section_changes: List[Dict]) -> Dict[str, int]:
+    """Lines added/removed and sections changed, from compare_sections() output."""
+    added = removed = 0
+    for change in section_changes:
+        for tag, i1, i2, j1, j2 in change.get('opcodes', ()):
+            if tag != 'equal':
+                removed += i2 - i1
+                added += j2 - j1
+    return {'lines_added': added, 'lines_removed': removed, 'sections_changed': len(section_changes)}
+
+def compare_sections(old_text: str, new_text: str):
+    """
+    Section-aware replacement for compare_text. Only sections whose hash
+    changed are diffed. Returns (changed_lines, section_changes): the lines are
+    in compare_text format, each section's block opened by a
+    '--- SECTION <path> (<status>) ---' marker line; renumbered sections
+    carry no line changes. Each section change also gets its 'opcodes'
+    (see section_opcodes), so reports and the version_diffs table never
+    have to diff again.
+    """
+    print("Starting section-aware comparison of old and new rule versions...")
+    old_lines = old_text.splitlines()
+    new_lines = new_text.splitlines()
+    section_changes = diff_sections(old_text, new_text)
+
+    changed_lines = []
+    for change in section_changes:
+        if change['status'] == 'renumbered':
+            change['opcodes'] = []
+            continue
+        change['opcodes'] = section_opcodes(old_lines, new_lines, change)
+        lines = opcode_lines(old_lines, new_lines, change['opcodes'])
+        if lines:
+            changed_lines.append(f"--- SECTION {section_label(change['path'])} ({change['status']}) ---")
+            changed_lines.extend(lines)
+
+    print(f"Comparison finished. {len(section_changes)} section(s) differ, {len(changed_lines)} lines of changes.")
+    return changed_lines, section_changes
+
+# End of sections.py
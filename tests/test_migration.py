@@ -0,0 +1,79 @@
+# tests/test_migration.py
+
+import os
+import sqlite3
+import tempfile
+import unittest
+from src import database_manager as db
+
+# The rule_versions table as the baseline release created it, before any
+# of the storage, metadata or search columns were added
+BASELINE_SCHEMA = """
+    CREATE TABLE rule_versions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        rule_id TEXT NOT NULL,
+        rule_text TEXT NOT NULL,
+        change_summary TEXT,
+        check_date TEXT NOT NULL
+    );
+"""
+
+TEXTS = {
+    'FINRA-2010': ["(a) Members shall observe high standards of commercial honor.\n(b) No member shall deceive.",
+                   "(a) Members shall observe high standards of commercial honor.\n(b) No member shall deceive.\n(c) New."],
+    'FINRA-3110': ["(a) Each member shall establish and maintain a system to supervise."],
+}
+
+
+class BaselineDatabaseTest(unittest.TestCase):
+    """Opening and converting a database written by the baseline schema."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.saved_path = db.DB_PATH
+        db.close_connections()
+        db.DB_PATH = os.path.join(self.tmp.name, 'regulations.db')
+        conn = sqlite3.connect(db.DB_PATH)
+        conn.execute(BASELINE_SCHEMA)
+        day = 1
+        for rule_id, texts in TEXTS.items():
+            for text in texts:
+                conn.execute("INSERT INTO rule_versions (rule_id, rule_text, change_summary, check_date) VALUES (?, ?, ?, ?)",
+                             (rule_id, text, "Baseline", f"2024-01-{day:02d}T09:00:00"))
+                day += 1
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        db.close_connections()
+        db.DB_PATH = self.saved_path
+        self.tmp.cleanup()
+
+    def assert_texts_intact(self):
+        for rule_id, texts in TEXTS.items():
+            history = db.get_version_history(rule_id)
+            self.assertEqual([db.get_version_text(row['id']) for row in reversed(history)], texts)
+            self.assertEqual(db.get_latest_version(rule_id), texts[-1])
+
+    def test_reads_existing_versions(self):
+        self.assert_texts_intact()
+        history = db.get_version_history('FINRA-2010')
+        self.assertEqual(history[0]['line_count'], 3)
+
+    def test_logs_new_version(self):
+        new_text = TEXTS['FINRA-3110'][0] + "\n(b) Written procedures."
+        version_id = db.log_new_version('FINRA-3110', new_text, "Change")
+        self.assertIsNotNone(version_id)
+        self.assertEqual(db.get_latest_version('FINRA-3110'), new_text)
+        self.assertIsNotNone(db.get_version_diff(version_id - 1, version_id))
+
+    def test_migrate_storage_round_trip(self):
+        for mode in ('blob', 'delta', 'text', 'blob'):
+            db.migrate_storage(mode)
+            self.assert_texts_intact()
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+# End of test_migration.py